@@ -1,10 +1,21 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import os
-from gitFetcher import get_git_data_from_path
+import json
+import time
+import uuid
+import bubliklog # First, it sets up logging for the modules below
+from gitFetcher import get_git_data_from_path, stream_git_data_from_path, get_git_data_for_groups
+from gitFetcher import query_git_data, stream_indexed_git_data, count_indexed_git_data
+from datetime import datetime, timezone
 from database import User, sign_in
 import bublikchat
+import bublikmetrics
+import bublikprofile
 import bublikproblem # Ensure this is the file where you updated distribute_tasks
+import bublikllm
+import bublikjobs
+import bublikprefetch
 import database
 
 # Initialize Flask app
@@ -13,13 +24,89 @@ app = Flask(__name__)
 # Enable CORS for all routes and origins
 CORS(app)
 
+# Request ids in the logs and one log line per request
+bubliklog.instrument_app(app, "app")
+
+# Route latencies and the /metrics endpoint
+bublikmetrics.instrument_app(app, "app")
+
+# Sampled request profiles, only with PROFILE=1
+bublikprofile.instrument_app(app, "app")
+
 # Load configuration
 app.config["DEBUG"] = os.environ.get("FLASK_DEBUG", True)
 
+@app.errorhandler(bublikllm.LLMBusyError)
+def llm_busy(e):
+    # The AI slots are all taken, tell the client to retry instead of hanging
+    return jsonify({"status": "error", "message": str(e)}), 503, {"Retry-After": "5"}
+
+
+def arg_flag(name: str) -> bool:
+    """
+    ?name=1 or ?name=true, so ?name=0 and ?name=false are off.
+    """
+    return request.args.get(name, "").lower() in ("1", "true")
+
+
+def wants_stream(data) -> bool:
+    """
+    Server-Sent Events are used when the client asks for text/event-stream,
+    or sends ?stream=1 / {"stream": true}.
+    """
+    return (
+        arg_flag("stream")
+        or bool((data or {}).get("stream"))
+        or "text/event-stream" in request.headers.get("Accept", "")
+    )
+
+
+def sse(event: str, data, id=None) -> str:
+    # With an id, a reconnecting EventSource sends it back as Last-Event-ID
+    prefix = f"id: {id}\n" if id is not None else ""
+    return f"{prefix}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(events) -> Response:
+    return Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def stream_events(pieces, event: str, payload, summary):
+    """
+    Sends one `event` per piece, then a "done" event built by `summary`
+    from the collected payloads, or an "error" event if generation fails.
+    """
+    start = time.perf_counter()
+    first = None
+    collected = []
+    try:
+        for piece in pieces:
+            if first is None:
+                first = time.perf_counter()
+            collected.append(piece)
+            yield sse(event, payload(len(collected) - 1, piece))
+    except Exception as e:
+        yield sse("error", {"status": "error", "message": str(e)})
+        return
+    done = summary(collected)
+    done["time_to_first_ms"] = round(((first or time.perf_counter()) - start) * 1000, 1)
+    done["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    yield sse("done", done)
+
+
 @app.route("/chatbot", methods=["POST"])
 def chatbot():
     """
-    a
+    {"message": "...", "session_id": "...", "stream": false}
+    Returns {"answer": "...", "session_id": "..."}. When streaming, sends
+    "token" events with {"delta": "..."} and a final "done" event with the
+    whole answer, the session id, timings and token usage. Without a
+    session_id a new one is returned for the client to send next time;
+    the earlier turns of the session are the context of the answer.
     """
     data = request.get_json()
     # Check that the request has a valid JSON body with a 'message' key
@@ -27,45 +114,506 @@ def chatbot():
         return jsonify({"status": "error", "message": "Invalid request body"}), 400
 
     user_message = data.get("message")
+    session_id = str(data.get("session_id") or uuid.uuid4().hex)
+
+    if wants_stream(data):
+        usage = {}
+        return sse_response(stream_events(
+            bublikchat.stream_chat_with_context(user_message, session_id, usage),
+            "token",
+            lambda i, delta: {"delta": delta},
+            lambda parts: {"answer": "".join(parts).strip(), "session_id": session_id, "usage": usage},
+        ))
 
-    # Call the get_answer function from your other file
-    ai_answer = bublikchat.get_answer(user_message)
+    # Answer with the session's earlier turns as context and store this one
+    ai_answer = bublikchat.chat_with_context(user_message, session_id)
 
     # Return the real AI response in a JSON object
     # The frontend will look for this "answer" key.
-    return jsonify({"answer": ai_answer})
+    return jsonify({"answer": ai_answer, "session_id": session_id})
 
 # Routes
+def prefetch_tasks(data, ideas) -> int:
+    """
+    Speculatively generates the tasks of the first ideas when the request
+    opts in with {"prefetch": true} (default SPECULATIVE_TASKS), so the
+    /api/tasks call that usually follows is answered at once.
+    """
+    if not data.get("prefetch", bublikprefetch.ENABLED):
+        return 0
+    return bublikprefetch.speculate(ideas, data.get("group"), bublikproblem.distribute_tasks)
+
+
 @app.route("/api/ideas", methods=["POST"])
 def get_ideas():
     """
-    {"problem": "Describe your problem here"}
+    {"problem": "Describe your problem here", "stream": false, "prefetch": false, "group": null}
+    When streaming, sends an "idea" event with {"index", "idea"} as soon as
+    each numbered line is complete and a final "done" event with all ideas.
+    With prefetch, the tasks of the top ideas (for `group`) are generated in
+    the background, "prefetching" says for how many.
     """
     data = request.get_json()
+    if wants_stream(data):
+        usage = {}
+
+        def summary(ideas):
+            return {"ideas": ideas, "usage": usage, "prefetching": prefetch_tasks(data, ideas)}
+
+        return sse_response(stream_events(
+            bublikproblem.stream_ideas(data["problem"], usage=usage),
+            "idea",
+            lambda i, idea: {"index": i, "idea": idea},
+            summary,
+        ))
     ideas = bublikproblem.propose_ideas(data["problem"])
-    return jsonify({"ideas": ideas})
+    body = {"ideas": ideas}
+    if data.get("prefetch", bublikprefetch.ENABLED):
+        body["prefetching"] = prefetch_tasks(data, ideas)
+    return jsonify(body)
+
+def wants_async(data) -> bool:
+    """
+    The client asked for a background job with ?async=1 or {"async": true}.
+    """
+    return arg_flag("async") or bool((data or {}).get("async"))
+
+
+def job_accepted(job_id: str):
+    status_url = f"/api/jobs/{job_id}"
+    return (
+        jsonify({"job_id": job_id, "status": "queued", "status_url": status_url}),
+        202,
+        {"Location": status_url},
+    )
+
+
+def task_events(events):
+    start = time.perf_counter()
+    first = None
+    count = 0
+    try:
+        for event, payload in events:
+            if event == "task":
+                if first is None:
+                    first = time.perf_counter()
+                yield sse("task", {"index": count, "task": payload})
+                count += 1
+            elif event == "analysis":
+                yield sse("analysis", {"analysis": payload})
+            else:
+                done = dict(payload)
+                done["time_to_first_ms"] = round(((first or time.perf_counter()) - start) * 1000, 1)
+                done["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                yield sse("done", done)
+    except Exception as e:
+        yield sse("error", {"status": "error", "message": str(e)})
+
+
+MAX_TASK_PAGE = 200
+
+
+@app.route("/api/tasks", methods=["GET"])
+def list_tasks():
+    """
+    Stored tasks, one page at a time:
+      ?assignee=          assigned_to
+      ?status=todo,review ?priority=high    one or more, comma separated
+      ?due_from= ?due_to= inclusive ISO dates
+      ?order=id|due_date  ?limit=50 ?cursor=<next_cursor>
+      ?fields=id,title,status   only these columns
+    Returns {"results": [...], "next_cursor": ..., "revision": r}, pass
+    `revision` to /api/tasks/changes to follow the changes from there.
+    """
+    args = request.args
+    # Read first, a change racing the query is then sent again by the feed
+    revision = database.tasks_revision()
+
+    def csv(name):
+        return [v for v in args.get(name, "").split(",") if v] or None
+
+    try:
+        limit = int(args.get("limit", 50))
+        if not 0 < limit <= MAX_TASK_PAGE:
+            raise ValueError(f"limit must be between 1 and {MAX_TASK_PAGE}")
+        for name in ("due_from", "due_to"):
+            if args.get(name):
+                datetime.fromisoformat(args[name])
+        results, next_cursor = database.query_tasks(
+            limit=limit,
+            cursor=args.get("cursor"),
+            fields=csv("fields"),
+            order=args.get("order", "id"),
+            assigned_to=args.get("assignee"),
+            status=csv("status"),
+            priority=csv("priority"),
+            due_from=args.get("due_from"),
+            due_to=args.get("due_to"),
+        )
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Invalid query: {e}"}), 400
+    return jsonify({"results": results, "next_cursor": next_cursor, "revision": revision})
+
+
+MAX_CHANGES_WAIT = 60
+TASK_STREAM_SECONDS = 300
+
+
+@app.route("/api/tasks/changes", methods=["GET"])
+def task_changes():
+    """
+    ?since=<revision>  tasks changed after that revision (0 for all)
+    Returns {"changes": [...], "deleted": [ids], "revision": r, "more": bool}
+      ?wait=30    long poll, answers as soon as something changes
+      ?stream=1   Server-Sent Events, a "changes" event per batch with the
+                  revision as event id (EventSource resumes from it)
+      ?fields=id,status,revision  ?limit=500
+    """
+    args = request.args
+    try:
+        since = int(request.headers.get("Last-Event-ID") or args.get("since", 0))
+        limit = int(args.get("limit", 500))
+        if not 0 < limit <= 1000:
+            raise ValueError("limit must be between 1 and 1000")
+        wait = min(float(args.get("wait", 0)), MAX_CHANGES_WAIT)
+        fields = [f for f in args.get("fields", "").split(",") if f] or None
+        # Validates the fields before a stream starts
+        changes = database.task_changes(since, limit, fields)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Invalid query: {e}"}), 400
+
+    if wants_stream(None):
+        return sse_response(task_change_events(changes, since, limit, fields))
+    if wait > 0 and not changes["changes"] and not changes["deleted"]:
+        database.wait_for_tasks(since, wait)
+        changes = database.task_changes(since, limit, fields)
+    return jsonify(changes)
+
+
+def task_change_events(changes: dict, since: int, limit: int, fields):
+    """
+    Sends each batch of changes as it happens. Ends after TASK_STREAM_SECONDS,
+    EventSource reconnects on its own and resumes from the last event id.
+    """
+    deadline = time.monotonic() + TASK_STREAM_SECONDS
+    while True:
+        if changes["changes"] or changes["deleted"]:
+            yield sse("changes", changes, id=changes["revision"])
+        since = changes["revision"]
+        if not changes["more"]:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if database.wait_for_tasks(since, min(15, remaining)) <= since:
+                yield ": keep-alive\n\n"
+        changes = database.task_changes(since, limit, fields)
+
+
+@app.route("/api/tasks/<int:task_id>", methods=["PATCH", "DELETE"])
+def change_task(task_id: int):
+    """
+    PATCH {"status": "done", ...} changes the given fields, DELETE removes the task.
+    Values are strings, priority is low, medium or high and due_date an ISO
+    date; anything else is a 400.
+    """
+    if request.method == "DELETE":
+        found = database.delete_task(task_id)
+    else:
+        data = request.get_json()
+        if not isinstance(data, dict):
+            return jsonify({"status": "error", "message": "Expected a JSON object of fields"}), 400
+        try:
+            found = database.update_task(task_id, **data)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+    if not found:
+        return jsonify({"status": "error", "message": "Unknown task"}), 404
+    return jsonify({"status": "success"})
+
+
+@app.route("/api/tasks/bulk", methods=["POST"])
+def save_tasks():
+    """
+    {"tasks": [AiTask, ...], "start": "YYYY-MM-DD"}
+    Stores the tasks returned by /api/tasks in one transaction, due
+    estimatedDays after `start` (default today). Tasks stored before are skipped.
+    Returns {"inserted": n, "deduplicated": n, "rejected": n}.
+    """
+    data = request.get_json()
+    if not data or not isinstance(data.get("tasks"), list):
+        return jsonify({"status": "error", "message": "tasks list missing"}), 400
+    try:
+        start = datetime.fromisoformat(data["start"]).date() if data.get("start") else None
+    except ValueError:
+        return jsonify({"status": "error", "message": "start must be an ISO date"}), 400
+
+    valid = [t for t in data["tasks"] if bublikproblem.valid_task(t)]
+    counts = database.new_tasks(database.task_from_ai(t, start) for t in valid)
+    counts["rejected"] = len(data["tasks"]) - len(valid)
+    return jsonify(counts)
+
+
+def resources_body(idea: str) -> dict:
+    return {"resources": bublikproblem.recommend_resources(idea)}
+
 
 @app.route("/api/tasks", methods=["POST"])
 def get_tasks():
     """
-    {"idea": "Describe your idea here"}
+    {"idea": "Describe your idea here", "group": "<PBL group number>", "async": false, "stream": false}
+    Only the members of `group` are offered as assignees (everyone when
+    it is missing). The response includes the prompt token counts under "tokens".
+    When streaming, sends "analysis" and a "task" event with {"index", "task"}
+    as soon as each task object is complete and valid, then "done" with the
+    whole body; "truncated" is true if the answer was cut off, the complete
+    tasks are kept either way.
+    With async, returns 202 {"job_id", "status_url"} right away, the
+    result is then read from /api/jobs/<job_id>.
     """
     data = request.get_json()
+    group = data.get("group")
+    if wants_async(data):
+        return job_accepted(bublikjobs.submit(
+            "tasks", bublikproblem.distribute_tasks, idea=data["idea"], pbl_group_number=group
+        ))
+    prefetched = bublikprefetch.take(data["idea"], group)
+    if wants_stream(data):
+        if prefetched is not None:
+            events = [("analysis", prefetched["analysis"])] + [("task", t) for t in prefetched["tasks"]]
+            events.append(("done", prefetched))
+        else:
+            events = bublikproblem.stream_tasks(data["idea"], group)
+        return sse_response(task_events(events))
+    if prefetched is not None:
+        return jsonify(prefetched), 200, {"X-Prefetched": "1"}
     # bublikproblem.distribute_tasks now returns a dictionary { "analysis": "...", "tasks": [...] }
     # So, we can directly jsonify its output.
-    task_distribution_data = bublikproblem.distribute_tasks(data["idea"])
+    task_distribution_data = bublikproblem.distribute_tasks(data["idea"], group)
     return jsonify(task_distribution_data) # This will correctly jsonify the dict
 
 @app.route("/api/resources", methods=["POST"])
 #! Not sure if we will use it
 def get_resources():
+    """
+    {"idea": "Describe your idea here", "async": false}
+    """
+    data = request.get_json()
+    if wants_async(data):
+        return job_accepted(bublikjobs.submit("resources", resources_body, idea=data["idea"]))
+    return jsonify(resources_body(data["idea"]))
+
+MAX_PIPELINE_IDEAS = 10
+
+
+@app.route("/api/pipeline", methods=["POST"])
+def run_pipeline():
+    """
+    {"problem": "...", "top_k": 1, "idea_index": null, "group": null, "stream": false}
+    Proposes ideas, then generates tasks and resources for idea `idea_index`
+    (or the first `top_k` ideas) concurrently, so the whole flow takes about
+    as long as its slowest stage instead of the sum of the three calls.
+    Returns {"ideas": [...], "results": [{"index", "idea", "tasks", "resources"}], "errors": [...]}
+    where "tasks" is the /api/tasks body. When streaming, sends "idea",
+    "tasks", "resources" and "error" events as each stage finishes and
+    that body as the final "done" event.
+    """
     data = request.get_json()
-    resources = bublikproblem.recommend_resources(data["idea"]) # Changed to recommend_resources
-    return jsonify({"resources": resources})
+    if not data or not data.get("problem"):
+        return jsonify({"status": "error", "message": "problem missing"}), 400
+    try:
+        n_ideas = int(data.get("n_ideas", 5))
+        top_k = int(data.get("top_k", 1))
+        idea_index = data.get("idea_index")
+        idea_index = int(idea_index) if idea_index is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "n_ideas, top_k and idea_index must be integers"}), 400
+    if not 1 <= n_ideas <= MAX_PIPELINE_IDEAS or not 0 <= top_k <= n_ideas:
+        return jsonify({"status": "error", "message": f"need 1 <= n_ideas <= {MAX_PIPELINE_IDEAS} and 0 <= top_k <= n_ideas"}), 400
+    if idea_index is not None and not 0 <= idea_index < n_ideas:
+        return jsonify({"status": "error", "message": "idea_index out of range"}), 400
+
+    events = bublikproblem.pipeline(
+        data["problem"], top_k=top_k, idea_index=idea_index,
+        pbl_group_number=data.get("group"), n_ideas=n_ideas,
+    )
+    if wants_stream(data):
+        return sse_response(pipeline_events(events))
+    summary = {}
+    for _ in collect_pipeline(events, summary):
+        pass
+    return jsonify(summary)
+
+
+def collect_pipeline(events, summary: dict):
+    """
+    Passes the pipeline events through and builds the response body in `summary`.
+    """
+    start = time.perf_counter()
+    ideas, results, errors = [], {}, []
+    summary.update(ideas=ideas, results=[], errors=errors)
+    for event, payload in events:
+        if event == "idea":
+            ideas.append(payload["idea"])
+        elif event == "error":
+            errors.append(payload)
+        else:
+            result = results.setdefault(payload["index"], {"index": payload["index"], "idea": payload["idea"]})
+            result[event] = payload[event]
+        yield event, payload
+    summary["results"] = [results[i] for i in sorted(results)]
+    summary["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+
+def pipeline_events(events):
+    summary = {}
+    for event, payload in collect_pipeline(events, summary):
+        yield sse(event, payload)
+    yield sse("done", summary)
+
+
+MAX_JOB_WAIT = 60
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id: str):
+    """
+    Returns {"job_id", "kind", "status": queued|running|done|error, ...}
+    with "result" (the body the synchronous route would have returned)
+    once done, or "error".
+      ?wait=30   long poll, answers as soon as the job finishes
+      ?stream=1  Server-Sent Events: "status" while pending, then "done"
+    """
+    job = bublikjobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job"}), 404
+
+    if wants_stream(None):
+        return sse_response(job_events(job))
+    try:
+        wait = min(float(request.args.get("wait", 0)), MAX_JOB_WAIT)
+    except ValueError:
+        return jsonify({"status": "error", "message": "wait must be a number of seconds"}), 400
+    if wait > 0 and job["status"] in ("queued", "running"):
+        job = bublikjobs.wait(job_id, wait)
+    return jsonify(job)
+
+
+def job_events(job: dict):
+    status = None
+    while True:
+        if job["status"] in ("done", "error"):
+            yield sse("done", job)
+            return
+        if job["status"] != status:
+            status = job["status"]
+            yield sse("status", job)
+        job = bublikjobs.wait(job["job_id"], 15)
+        if job["status"] == status:
+            yield ": keep-alive\n\n"
+
+MAX_GIT_PAGE = 500
+
+
+def parse_time_arg(value: str) -> int:
+    """
+    Epoch seconds or an ISO date (UTC if no offset is given).
+    """
+    if value.isdigit():
+        return int(value)
+    t = datetime.fromisoformat(value)
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    return int(t.timestamp())
+
+
+def git_query_args(args) -> dict:
+    """
+    Reads the pagination and filter query parameters of /git/<group_number>.
+    Raises ValueError on malformed values.
+    """
+    limit = args.get("limit")
+    if limit is not None:
+        limit = int(limit)
+        if not 0 < limit <= MAX_GIT_PAGE:
+            raise ValueError(f"limit must be between 1 and {MAX_GIT_PAGE}")
+    cursor = args.get("cursor")
+    return {
+        "limit": limit,
+        "cursor": int(cursor) if cursor is not None else None,
+        "author": args.get("author"),
+        "email": args.get("email"),
+        "since": parse_time_arg(args["since"]) if args.get("since") else None,
+        "until": parse_time_arg(args["until"]) if args.get("until") else None,
+        "path_prefix": args.get("path"),
+    }
+
 
 @app.route("/git/<group_number>", methods=["GET"])
 def get_git_data(group_number: int):
-    return jsonify(results=get_git_data_from_path(group_number))
+    """
+    Served from the commit index:
+      ?limit=50&cursor=<next_cursor>   keyset pagination, newest first
+      ?author=  name or email, ?email=, ?since= / ?until= epoch or ISO date,
+                of the committer (the author/email/date shown) or, with
+                ?format=numstat, of the author
+      ?path=    file path prefix
+    Returns {"results": [...], "total": <matching commits>, "next_cursor": ...}
+    ?stream=1 sends the commits as they are read, same body shape.
+    ?format=numstat returns typed commits with numeric per-file stats.
+    ?live=1 runs git log directly instead (no pagination or filters).
+    """
+    mode = request.args.get("format", "stat")
+    if mode not in ("stat", "numstat"):
+        return jsonify({"status": "error", "message": "format must be stat or numstat"}), 400
+    try:
+        query = git_query_args(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Invalid query: {e}"}), 400
+
+    live = arg_flag("live")
+    if arg_flag("stream"):
+        source = live_git_results(group_number, mode) if live else indexed_git_results(group_number, mode, query)
+        return Response(stream_with_context(source), mimetype="application/json")
+    if live:
+        return jsonify(results=get_git_data_from_path(group_number, mode=mode))
+    return jsonify(query_git_data(group_number, mode=mode, **query))
+
+
+def live_git_results(group_number: int, mode: str = "stat"):
+    yield '{"results": ['
+    for i, commit in enumerate(stream_git_data_from_path(group_number, mode=mode)):
+        yield ("," if i else "") + json.dumps(commit)
+    yield "]}"
+
+
+def indexed_git_results(group_number: int, mode: str, query: dict):
+    limit = query["limit"]
+    filters = {k: v for k, v in query.items() if k not in ("limit", "cursor")}
+    seq = None
+    count = 0
+    yield '{"results": ['
+    for seq, commit in stream_indexed_git_data(group_number, mode=mode, limit=limit, cursor=query["cursor"], **filters):
+        yield ("," if count else "") + json.dumps(commit)
+        count += 1
+    next_cursor = seq if limit and count == limit else None
+    total = count_indexed_git_data(group_number, mode, **filters)
+    yield f'], "total": {total}, "next_cursor": {json.dumps(next_cursor)}}}'
+
+
+@app.route("/git/batch", methods=["POST"])
+def get_git_data_batch():
+    """
+    {"groups": [1, 2, 3], "format": "stat"}
+    Returns {"results": {"1": [...], "2": [...], ...}}
+    """
+    data = request.get_json()
+    if not data or not isinstance(data.get("groups"), list):
+        return jsonify({"status": "error", "message": "groups list missing"}), 400
+    mode = data.get("format", "stat")
+    if mode not in ("stat", "numstat"):
+        return jsonify({"status": "error", "message": "format must be stat or numstat"}), 400
+
+    return jsonify(results=get_git_data_for_groups(data["groups"], mode=mode))
 
 
 # Put for only method of post and get the form data
@@ -116,7 +664,7 @@ def register():
 
 
 if __name__ == "__main__":
-    port = 5500
+    port = int(os.environ.get("PORT", 5500))
     database.init_convo_db()
 
     app.run(host="0.0.0.0", port=port)
\ No newline at end of file
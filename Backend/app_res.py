@@ -1,23 +1,47 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import os
+import uuid
+
+import bubliklog # First, it sets up logging for the modules below
 
 # External modules (ensure these exist and are importable)
 import bublikchat
+import bublikllm
+import bublikmetrics
+import bublikprofile
 import bublikresources
 
 app = Flask(__name__)
 CORS(app)
 
+# Request ids in the logs and one log line per request
+bubliklog.instrument_app(app, "app_res")
+
+# Route latencies and the /metrics endpoint
+bublikmetrics.instrument_app(app, "app_res")
+
+# Sampled request profiles, only with PROFILE=1
+bublikprofile.instrument_app(app, "app_res")
+
 # Load configuration
 app.config["DEBUG"] = os.environ.get("FLASK_DEBUG", True)
 
 
+@app.errorhandler(bublikllm.LLMBusyError)
+def llm_busy(e):
+    # The AI slots are all taken, tell the client to retry instead of hanging
+    return jsonify({"status": "error", "message": str(e)}), 503, {"Retry-After": "5"}
+
+
 @app.route("/chatbot", methods=["POST"])
 def chatbot():
     """
-    Placeholder for chatbot integration.
     Handles incoming chatbot messages.
+    Expects JSON: { "message": "...", "session_id": "..." }
+    Returns: { "status": "success", "answer": "...", "session_id": "..." }
+    Without a session_id a new conversation is started; the client sends
+    the returned id with its next messages.
     """
     payload = request.get_json()
     if not payload:
@@ -27,9 +51,13 @@ def chatbot():
     if not message:
         return jsonify({"status": "error", "message": "No message provided"}), 400
 
+    # Every client has its own memory, never a shared one
+    session_id = str(payload.get("session_id") or uuid.uuid4().hex)
     try:
-        # This should process the message and update context or return a reply
-        bublikchat.chat_with_context(message)
+        # Replies with the conversation memory of this session
+        reply = bublikchat.chat_with_context(message, session_id)
+    except bublikllm.LLMBusyError:
+        raise
     except Exception as e:
         app.logger.error(f"Chatbot processing failed: {e}")
         return (
@@ -40,7 +68,9 @@ def chatbot():
     return jsonify(
         {
             "status": "success",
-            "message": "Chatbot integration not implemented yet.",
+            "message": reply,
+            "answer": reply,
+            "session_id": session_id,
         }
     )
 
@@ -59,6 +89,8 @@ def get_ideas():
     try:
         ideas = bublikresources.propose_ideas(payload["problem"])
         return jsonify({"ideas": ideas})
+    except bublikllm.LLMBusyError:
+        raise
     except Exception as e:
         app.logger.error(f"Error generating ideas: {e}")
         return (
@@ -76,7 +108,7 @@ def get_ideas():
 def get_tasks():
     """
     Distribute tasks for a chosen idea.
-    Expects JSON: { "idea": "Describe your idea here" }
+    Expects JSON: { "idea": "Describe your idea here", "group": "<PBL group number>" }
     Returns: { "tasks": [...] }
     """
     payload = request.get_json()
@@ -84,8 +116,10 @@ def get_tasks():
         return jsonify({"status": "error", "message": "Idea description missing"}), 400
 
     try:
-        tasks = bublikresources.distribute_tasks(payload["idea"])
+        tasks = bublikresources.distribute_tasks(payload["idea"], payload.get("group"))
         return jsonify({"tasks": tasks})
+    except bublikllm.LLMBusyError:
+        raise
     except Exception as e:
         app.logger.error(f"Error distributing tasks: {e}")
         return (
@@ -121,6 +155,8 @@ def get_resources():
     try:
         resources = bublikresources.get_resources(payload["idea"])
         return jsonify({"resources": resources})
+    except bublikllm.LLMBusyError:
+        raise
     except Exception as e:
         app.logger.error(f"Error fetching resources: {e}")
         return (
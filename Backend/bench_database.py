@@ -0,0 +1,109 @@
+"""
+Reads from threads while another process keeps writing, rollback journal vs WAL.
+With the rollback journal readers and the writer lock each other out (the
+writer cannot commit while readers hold SHARED locks), with WAL both keep going.
+Reader latency includes GIL waits between the reader threads.
+
+    python bench_database.py
+    python bench_database.py --readers 8 --seconds 5
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import database
+
+
+def seed(path: str, rows: int):
+    conn = database.connect(path)
+    conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, grp TEXT NOT NULL, payload TEXT NOT NULL)")
+    conn.execute("CREATE INDEX items_by_grp ON items (grp)")
+    conn.executemany(
+        "INSERT INTO items (grp, payload) VALUES (?, ?)",
+        ((str(i % 100), "x" * 200) for i in range(rows)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def writer(path: str, journal_mode: str, stop, batch: int, counter):
+    """
+    Runs in its own process, like a second web worker would.
+    """
+    conn = database.connect(path, journal_mode)
+    rows = [(str(j % 100), "y" * 200) for j in range(batch)]
+    while not stop.is_set():
+        with conn:
+            conn.executemany("INSERT INTO items (grp, payload) VALUES (?, ?)", rows)
+        counter.value += 1
+    conn.close()
+
+
+def reader(path: str, journal_mode: str, stop: threading.Event, latencies: list):
+    conn = database.connect(path, journal_mode)
+    grp = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        conn.execute("SELECT COUNT(*), MAX(id) FROM items WHERE grp = ?", (str(grp % 100),)).fetchone()
+        latencies.append(time.perf_counter() - start)
+        grp += 1
+    conn.close()
+
+
+def run(journal_mode: str, readers: int, seconds: float, rows: int, batch: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        seed(path, rows)
+        # The journal mode is stored in the file for WAL, set it once up front
+        database.connect(path, journal_mode).close()
+
+        stop = threading.Event()
+        stop_writer = multiprocessing.Event()
+        commits = multiprocessing.Value("i", 0)
+        latencies = [[] for _ in range(readers)]
+        proc = multiprocessing.Process(target=writer, args=(path, journal_mode, stop_writer, batch, commits))
+        threads = [
+            threading.Thread(target=reader, args=(path, journal_mode, stop, latencies[i]))
+            for i in range(readers)
+        ]
+        proc.start()
+        for t in threads:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        stop_writer.set()
+        for t in threads:
+            t.join()
+        proc.join()
+
+    reads = sorted(x for per_thread in latencies for x in per_thread)
+    return {
+        "reads/s": len(reads) / seconds,
+        "p50 ms": statistics.median(reads) * 1000,
+        "p99 ms": reads[int(len(reads) * 0.99)] * 1000,
+        "max ms": reads[-1] * 1000,
+        "commits/s": commits.value / seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--batch", type=int, default=2000, help="rows per write transaction")
+    args = parser.parse_args()
+
+    results = {mode: run(mode, args.readers, args.seconds, args.rows, args.batch) for mode in ("delete", "wal")}
+    columns = list(next(iter(results.values())))
+    print(f"{'journal':8}" + "".join(f"{c:>12}" for c in columns))
+    for mode, r in results.items():
+        print(f"{mode:8}" + "".join(f"{r[c]:12.2f}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
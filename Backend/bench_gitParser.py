@@ -0,0 +1,86 @@
+"""
+Compares the two gitParser modes on the same repository.
+
+    python bench_gitParser.py                 # synthetic repo, 5000 commits
+    python bench_gitParser.py --commits 50000
+    python bench_gitParser.py --repo /path/to/repo.git
+"""
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+
+import gitParser
+
+
+def make_repo(path: str, n_commits: int, files_per_commit: int = 3):
+    """
+    Builds a repository with git fast-import, much faster than n commits.
+    """
+    subprocess.run(["git", "init", "--bare", "--quiet", path], check=True)
+    proc = subprocess.Popen(
+        ["git", "--git-dir", path, "fast-import", "--quiet"], stdin=subprocess.PIPE
+    )
+    out = proc.stdin
+    for i in range(n_commits):
+        message = f"Commit {i}\n\nLonger description of change {i}.\n".encode()
+        out.write(b"commit refs/heads/master\n")
+        out.write(f"committer Bench User <bench@example.com> {1700000000 + i} +0000\n".encode())
+        out.write(f"data {len(message)}\n".encode() + message)
+        for j in range(files_per_commit):
+            content = f"{i}\n" * (1 + (i + j) % 20)
+            content = content.encode()
+            out.write(f"M 644 inline src/dir{j % 7}/file{(i + j) % 97}.txt\n".encode())
+            out.write(f"data {len(content)}\n".encode() + content)
+        out.write(b"\n")
+    out.close()
+    proc.wait()
+
+
+def best_of(fn, runs: int) -> tuple[float, int]:
+    best = float("inf")
+    count = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        count = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, count
+
+
+def git_log_only(git_dir: str, args: list[str]) -> int:
+    out = subprocess.run(["git", "--git-dir", git_dir, "log", *args], capture_output=True, check=True).stdout
+    return len(out)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repo", help="existing git dir, a synthetic one is built otherwise")
+    parser.add_argument("--commits", type=int, default=5000)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        git_dir = args.repo
+        if not git_dir:
+            git_dir = os.path.join(tmp, "bench.git")
+            print(f"Building synthetic repository with {args.commits} commits...")
+            make_repo(git_dir, args.commits)
+
+        cases = [
+            ("git log --stat (bytes)", lambda: git_log_only(git_dir, ["--stat", "--pretty=fuller"])),
+            ("git log --numstat -z (bytes)", lambda: git_log_only(git_dir, ["-z", "--numstat", f"--format={gitParser.NUMSTAT_FORMAT}"])),
+            ("stat parser", lambda: len(gitParser.get_git_data(git_dir))),
+            ("numstat parser", lambda: len(gitParser.get_git_data(git_dir, mode="numstat"))),
+            ("numstat parser, totals only", lambda: sum(1 for c in gitParser.stream_git_records(git_dir) if c.insertions >= 0)),
+        ]
+
+        print(f"{'case':32} {'best (s)':>10} {'count':>10} {'count/s':>12}")
+        for name, fn in cases:
+            elapsed, count = best_of(fn, args.runs)
+            rate = count / elapsed if elapsed else 0
+            print(f"{name:32} {elapsed:10.3f} {count:10} {rate:12.0f}")
+
+
+if __name__ == "__main__":
+    main()
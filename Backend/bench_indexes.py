@@ -0,0 +1,130 @@
+"""
+Query latency and EXPLAIN QUERY PLAN for the users/tasks lookups, before
+and after the schema migrations.
+
+    python bench_indexes.py                       # 100k users, 1M tasks
+    python bench_indexes.py --users 10000 --tasks 100000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import database
+
+STATUSES = ["todo", "in-progress", "review", "done"]
+PRIORITIES = ["low", "medium", "high"]
+
+# The queries the app runs, keep these in sync with database.py
+QUERIES = [
+    (
+        "github urls by PBL group",
+        'SELECT github_url FROM users WHERE "PBL group number" = ? AND github_url IS NOT NULL',
+        lambda r: (str(r.randrange(2000)),),
+    ),
+    (
+        "sign_in role check",
+        "SELECT 1 FROM users WHERE role = ?",
+        lambda r: (f"role-{r.randrange(200000)}",),
+    ),
+    (
+        "tasks by assignee",
+        "SELECT * FROM tasks WHERE assigned_to = ?",
+        lambda r: (f"user{r.randrange(100000)}@example.com",),
+    ),
+    (
+        "tasks by assignee and status",
+        "SELECT * FROM tasks WHERE assigned_to = ? AND status = ?",
+        lambda r: (f"user{r.randrange(100000)}@example.com", r.choice(STATUSES)),
+    ),
+    (
+        "open tasks count by status",
+        "SELECT COUNT(*) FROM tasks WHERE status = ?",
+        lambda r: (r.choice(STATUSES),),
+    ),
+    (
+        "tasks due in a week",
+        "SELECT id, title FROM tasks WHERE due_date BETWEEN ? AND ?",
+        lambda r: ("2025-03-01", "2025-03-07"),
+    ),
+]
+
+
+def seed(conn, n_users: int, n_tasks: int):
+    r = random.Random(42)
+    conn.executemany(
+        """
+        INSERT INTO users (
+            name, "Academic group", "PBL group number", email, role,
+            password, "Project name", github_url
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            (
+                f"User {i}", f"FAF-{i % 40}", str(i % 2000), f"user{i}@example.com",
+                f"role-{i}", "password", f"Project {i % 2000}",
+                f"https://github.com/group{i % 2000}/repo" if i % 5 == 0 else None,
+            )
+            for i in range(n_users)
+        ),
+    )
+    conn.executemany(
+        """
+        INSERT INTO tasks (
+            title, description, assigned_to, status, priority, due_date, hash
+        ) VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            (
+                f"Task {i}", "Description", f"user{r.randrange(n_users)}@example.com",
+                r.choice(STATUSES), r.choice(PRIORITIES),
+                f"2025-{r.randint(1, 12):02d}-{r.randint(1, 28):02d}", str(i),
+            )
+            for i in range(n_tasks)
+        ),
+    )
+    conn.commit()
+
+
+def measure(conn, runs: int) -> list[tuple[str, float, str]]:
+    out = []
+    for name, sql, make_params in QUERIES:
+        r = random.Random(7)
+        plan = " | ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, make_params(r)))
+        start = time.perf_counter()
+        for _ in range(runs):
+            conn.execute(sql, make_params(r)).fetchall()
+        out.append((name, (time.perf_counter() - start) / runs * 1000, plan))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--tasks", type=int, default=1_000_000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = database.connect(os.path.join(tmp, "bench.db"))
+        database.create_schema(conn)
+        print(f"Seeding {args.users} users and {args.tasks} tasks...")
+        seed(conn, args.users, args.tasks)
+
+        before = measure(conn, args.runs)
+        start = time.perf_counter()
+        version = database.migrate(conn)
+        conn.execute("ANALYZE")
+        print(f"Migrated to version {version} in {time.perf_counter() - start:.2f}s")
+        after = measure(conn, args.runs)
+        conn.close()
+
+    for (name, ms_before, plan_before), (_, ms_after, plan_after) in zip(before, after):
+        print(f"\n{name}: {ms_before:.3f} ms -> {ms_after:.3f} ms")
+        print(f"  before: {plan_before}")
+        print(f"  after:  {plan_after}")
+
+
+if __name__ == "__main__":
+    main()
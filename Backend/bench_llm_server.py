@@ -0,0 +1,230 @@
+"""
+Local stand-in for the OpenAI chat completions API, for load tests that
+must not call (or pay for) the real one. Point the backend at it with
+
+    python bench_llm_server.py --port 8900 --latency 300 --tps 60
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 OPENAI_API_KEY=stub python app.py
+
+Answers look like what the prompts ask for: numbered ideas, the tasks JSON
+object in JSON mode, a JSON list of resources, plain text otherwise.
+Streaming (with include_usage) is supported. Timing is modelled as time to
+first token (--latency, --jitter) plus output tokens at --tps tokens/s;
+--error-rate makes a fraction of requests fail with one of --error-status.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "team project user data app platform feedback schedule review build test "
+    "deploy design module service report student mentor sprint goal"
+).split()
+
+
+class Settings:
+    latency = 0.3
+    jitter = 0.1
+    tps = 60.0
+    max_tokens = 300
+    error_rate = 0.0
+    error_status = [429, 500]
+
+
+_stats = {"requests": 0, "errors": 0}
+_stats_lock = threading.Lock()
+
+
+def sentence(r: random.Random, n: int) -> str:
+    return " ".join(r.choice(WORDS) for _ in range(n)).capitalize()
+
+
+def ideas_answer(r: random.Random, n_ideas: int) -> str:
+    return "\n".join(f"{i}. {sentence(r, 12)}." for i in range(1, n_ideas + 1))
+
+
+def tasks_answer(r: random.Random, roles: list) -> str:
+    tasks = [
+        {
+            "title": sentence(r, 4),
+            "description": sentence(r, 16) + ".",
+            "assignedRole": r.choice(roles),
+            "priority": r.choice(["low", "medium", "high"]),
+            "estimatedDays": r.randint(1, 10),
+            "tags": r.sample(WORDS, 2),
+        }
+        for _ in range(6)
+    ]
+    return json.dumps({"analysis": sentence(r, 30) + ".", "tasks": tasks}, indent=2)
+
+
+def resources_answer(r: random.Random) -> str:
+    return json.dumps([
+        {
+            "title": sentence(r, 5),
+            "link": f"https://example.com/{r.choice(WORDS)}/{i}",
+            "description": sentence(r, 14) + ".",
+        }
+        for i in range(4)
+    ], indent=2)
+
+
+def answer_for(body: dict) -> str:
+    """
+    Picks the kind of answer from the prompts the backend sends.
+    """
+    messages = body.get("messages", [])
+    system = next((m["content"] for m in messages if m["role"] == "system"), "")
+    prompt = " ".join(m["content"] for m in messages)
+    r = random.Random(prompt)
+
+    if (body.get("response_format") or {}).get("type") == "json_object" or "'tasks'" in system:
+        match = re.search(r"Available roles: ([^\n]+)", system)
+        roles = [x.strip() for x in match.group(1).split(",")] if match else ["Software Developer"]
+        return tasks_answer(r, roles)
+    if "solution ideas" in prompt:
+        match = re.search(r"propose (\d+)", system)
+        return ideas_answer(r, int(match.group(1)) if match else 5)
+    if "JSON format as a list" in system:
+        return resources_answer(r)
+    limit = min(body.get("max_tokens") or Settings.max_tokens, Settings.max_tokens)
+    return sentence(r, max(1, limit * 3 // 4)) + "."
+
+
+def pieces(text: str):
+    # Roughly one token per 4 characters, like the real tokenizer on English
+    return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, data: dict, headers: dict = None):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            with _stats_lock:
+                return self.send_json(200, dict(_stats))
+        self.send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self.send_json(404, {"error": {"message": "not found"}})
+        with _stats_lock:
+            _stats["requests"] += 1
+
+        time.sleep(max(0.0, random.gauss(Settings.latency, Settings.jitter)))
+        if random.random() < Settings.error_rate:
+            status = random.choice(Settings.error_status)
+            with _stats_lock:
+                _stats["errors"] += 1
+            return self.send_json(
+                status,
+                {"error": {"message": f"Injected error {status}", "type": "stub_error"}},
+                {"Retry-After": "0"} if status == 429 else None,
+            )
+
+        text = answer_for(body)
+        tokens = pieces(text)
+        prompt_tokens = sum(len(m["content"]) for m in body.get("messages", [])) // 4
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+        base = {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+        }
+        if body.get("stream"):
+            return self.stream(base, tokens, usage, (body.get("stream_options") or {}).get("include_usage"))
+
+        time.sleep(len(tokens) / Settings.tps)
+        self.send_json(200, {
+            **base,
+            "object": "chat.completion",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+    def stream(self, base: dict, tokens: list, usage: dict, include_usage: bool):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send(chunk: dict):
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+
+        chunk = {**base, "object": "chat.completion.chunk"}
+        try:
+            send({**chunk, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]})
+            for token in tokens:
+                time.sleep(1 / Settings.tps)
+                send({**chunk, "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]})
+            send({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            if include_usage:
+                send({**chunk, "choices": [], "usage": usage})
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client went away mid-stream
+
+
+def make_server(port: int = 8900, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=300, help="time to first token, ms")
+    parser.add_argument("--jitter", type=float, default=100, help="std deviation of the latency, ms")
+    parser.add_argument("--tps", type=float, default=60, help="output tokens per second")
+    parser.add_argument("--max-tokens", type=int, default=300, help="cap on plain text answers")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", default="429,500", help="comma separated statuses to inject")
+    args = parser.parse_args()
+
+    Settings.latency = args.latency / 1000
+    Settings.jitter = args.jitter / 1000
+    Settings.tps = args.tps
+    Settings.max_tokens = args.max_tokens
+    Settings.error_rate = args.error_rate
+    Settings.error_status = [int(s) for s in args.error_status.split(",")]
+
+    server = make_server(args.port, args.host)
+    print(f"Stub LLM listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
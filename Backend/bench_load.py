@@ -0,0 +1,216 @@
+"""
+Load test for the backend routes at a few concurrency levels, reporting
+p50/p95/p99 latency and throughput per route.
+
+With --spawn it starts everything offline: the stub LLM from
+bench_llm_server.py and the app in a temporary directory (fresh databases,
+LLM cache off), with /git/<group> mirroring this repository.
+
+    python bench_load.py --spawn                               # app.py, all routes
+    python bench_load.py --spawn --app app_res.py --routes chatbot,tasks
+    python bench_load.py --spawn --latency 800 --error-rate 0.05 --concurrency 1,8,32
+    python bench_load.py --url http://127.0.0.1:5500           # an app you started yourself
+"""
+import argparse
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import bench_llm_server
+
+FILE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_counter = itertools.count()
+
+
+def _unique(text: str) -> str:
+    # Different prompt every request so the LLM cache cannot answer it
+    return f"{text} (#{next(_counter)})"
+
+
+# name -> (method, path, body builder)
+ROUTES = {
+    "ideas": ("POST", "/api/ideas", lambda a: {"problem": _unique("Students miss project deadlines")}),
+    "tasks": ("POST", "/api/tasks", lambda a: {"idea": _unique("A shared sprint board with reminders")}),
+    "resources": ("POST", "/api/resources", lambda a: {"idea": _unique("A shared sprint board with reminders")}),
+    "chatbot": ("POST", "/chatbot", lambda a: {"message": _unique("Who works on the backend?"), "session_id": f"load-{next(_counter)}"}),
+    "pipeline": ("POST", "/api/pipeline", lambda a: {"problem": _unique("Students miss project deadlines"), "top_k": 1}),
+    "git": ("GET", "/git/{group}", None),
+}
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    # Nearest rank
+    if not sorted_values:
+        return float("nan")
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def request_once(url: str, method: str, body, timeout: float) -> tuple[float, int]:
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        status = e.code
+    except OSError:
+        status = 0
+    return time.perf_counter() - start, status
+
+
+def run_level(base_url: str, route: str, concurrency: int, requests: int, args) -> dict:
+    method, path, make_body = ROUTES[route]
+    url = base_url + path.format(group=args.group)
+    results = []
+    lock = threading.Lock()
+
+    def work(_):
+        latency, status = request_once(url, method, make_body(args) if make_body else None, args.timeout)
+        with lock:
+            results.append((latency, status))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(work, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    ok = sorted(lat for lat, status in results if 200 <= status < 300)
+    return {
+        "route": route,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "rps": len(ok) / elapsed,
+        "p50_ms": percentile(ok, 50) * 1000,
+        "p95_ms": percentile(ok, 95) * 1000,
+        "p99_ms": percentile(ok, 99) * 1000,
+        "statuses": sorted({status for _, status in results}),
+    }
+
+
+def wait_for_port(port: int, proc: subprocess.Popen, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"app exited with code {proc.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"app did not listen on port {port} within {timeout}s")
+
+
+def spawn(args, workdir: str):
+    """
+    Starts the stub LLM in this process and the app as a subprocess.
+    """
+    s = bench_llm_server.Settings
+    s.latency, s.jitter, s.tps = args.latency / 1000, args.jitter / 1000, args.tps
+    s.error_rate = args.error_rate
+    llm = bench_llm_server.make_server(args.llm_port)
+    threading.Thread(target=llm.serve_forever, daemon=True).start()
+
+    git_url = args.git_url or subprocess.run(
+        ["git", "rev-parse", "--show-toplevel"], cwd=FILE_DIR, capture_output=True, text=True
+    ).stdout.strip()
+    env = {
+        **os.environ,
+        "PORT": str(args.port),
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.llm_port}/v1",
+        "LLM_CACHE": "1" if args.cache else "0",
+        "GIT_GROUP_URL": git_url,
+        "FLASK_DEBUG": "",
+    }
+    app = subprocess.Popen(
+        [sys.executable, os.path.join(FILE_DIR, args.app)],
+        cwd=workdir,
+        env=env,
+        stdout=subprocess.DEVNULL if not args.verbose else None,
+        stderr=subprocess.DEVNULL if not args.verbose else None,
+    )
+    try:
+        wait_for_port(args.port, app)
+    except Exception:
+        app.kill()
+        llm.shutdown()
+        raise
+    return llm, app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default=None, help="app to test, default the spawned one")
+    parser.add_argument("--routes", default=",".join(ROUTES))
+    parser.add_argument("--concurrency", default="1,4,16", help="comma separated levels")
+    parser.add_argument("--requests", type=int, default=50, help="requests per route and level")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--group", default="1", help="group for /git/<group>")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--spawn", action="store_true", help="start the stub LLM and the app")
+    parser.add_argument("--app", default="app.py", choices=["app.py", "app_res.py"])
+    parser.add_argument("--port", type=int, default=5599)
+    parser.add_argument("--llm-port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=300, help="stub time to first token, ms")
+    parser.add_argument("--jitter", type=float, default=100, help="stub latency std deviation, ms")
+    parser.add_argument("--tps", type=float, default=60, help="stub output tokens per second")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="stub injected error rate")
+    parser.add_argument("--git-url", help="repository behind /git/<group>, default this one")
+    parser.add_argument("--cache", action="store_true", help="keep the LLM cache on")
+    parser.add_argument("--verbose", action="store_true", help="show the app output")
+    args = parser.parse_args()
+
+    routes = [r.strip() for r in args.routes.split(",") if r.strip()]
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(sorted(unknown))}")
+    levels = [int(c) for c in args.concurrency.split(",")]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        llm = app = None
+        if args.spawn:
+            llm, app = spawn(args, workdir)
+        base_url = (args.url or f"http://127.0.0.1:{args.port}").rstrip("/")
+        try:
+            if "git" in routes:
+                # First request clones the mirror and builds the index, keep it out of the numbers
+                request_once(base_url + ROUTES["git"][1].format(group=args.group), "GET", None, args.timeout)
+            results = []
+            print(f"{'route':10}{'conc':>6}{'reqs':>6}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+            for route in routes:
+                for level in levels:
+                    r = run_level(base_url, route, level, args.requests, args)
+                    results.append(r)
+                    print(
+                        f"{route:10}{level:6}{r['requests']:6}{r['errors']:8}{r['rps']:9.1f}"
+                        f"{r['p50_ms']:10.1f}{r['p95_ms']:10.1f}{r['p99_ms']:10.1f}"
+                    )
+        finally:
+            if app is not None:
+                app.terminate()
+                app.wait()
+            if llm is not None:
+                llm.shutdown()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
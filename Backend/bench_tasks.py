@@ -0,0 +1,80 @@
+"""
+Rows per second storing AI task lists, one commit per row (new_task)
+vs one transaction per list (new_tasks), then the same lists again to
+show the deduplication.
+
+    python bench_tasks.py
+    python bench_tasks.py --lists 200 --tasks-per-list 8
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+PRIORITIES = ["low", "medium", "high"]
+
+
+def ai_lists(n_lists: int, per_list: int, seed: int) -> list[list[dict]]:
+    r = random.Random(seed)
+    return [
+        [
+            {
+                "title": f"Task {seed}-{i}-{j}",
+                "description": "Implement the feature and write the docs for it.",
+                "assignedRole": r.choice(["Backend", "Frontend", "Design", "QA"]),
+                "priority": r.choice(PRIORITIES),
+                "estimatedDays": r.randint(1, 10),
+                "tags": ["backend"],
+            }
+            for j in range(per_list)
+        ]
+        for i in range(n_lists)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lists", type=int, default=100, help="AI task lists per run")
+    parser.add_argument("--tasks-per-list", type=int, default=6)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # database creates my_database.db in the working directory on import
+        os.chdir(tmp)
+        import database
+
+        rows = args.lists * args.tasks_per_list
+        per_row = [[database.task_from_ai(t) for t in tasks] for tasks in ai_lists(args.lists, args.tasks_per_list, 1)]
+        bulk = [[database.task_from_ai(t) for t in tasks] for tasks in ai_lists(args.lists, args.tasks_per_list, 2)]
+
+        start = time.perf_counter()
+        for tasks in per_row:
+            for task in tasks:
+                database.new_task(task)
+        row_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        inserted = deduplicated = 0
+        for tasks in bulk:
+            counts = database.new_tasks(tasks)
+            inserted += counts["inserted"]
+            deduplicated += counts["deduplicated"]
+        bulk_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        again = {"inserted": 0, "deduplicated": 0}
+        for tasks in bulk + per_row:
+            for k, v in database.new_tasks(tasks).items():
+                again[k] += v
+        again_s = time.perf_counter() - start
+        os.chdir("/")
+
+    print(f"{rows} rows in {args.lists} lists")
+    print(f"new_task   per row : {rows / row_s:10.0f} rows/s")
+    print(f"new_tasks  per list: {rows / bulk_s:10.0f} rows/s  ({row_s / bulk_s:.1f}x, {inserted} inserted, {deduplicated} deduplicated)")
+    print(f"same lists again   : {2 * rows / again_s:10.0f} rows/s  ({again['inserted']} inserted, {again['deduplicated']} deduplicated)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict, Counter
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Any
+
+import database
+import bublikmetrics
+
+# ———————————————
+# Cache for chat completion responses
+# ———————————————
+# Two tiers: a small in-memory LRU per process and an SQLite table shared
+# by every worker. Keys are built from the model, a hash of the messages
+# and the generation parameters, so only identical requests share a result.
+
+CACHE_DB_PATH = "llm_cache.db"
+ENABLED = os.getenv("LLM_CACHE", "1") != "0"
+MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", 512))
+DISK_ENTRIES = int(os.getenv("LLM_CACHE_DISK_ENTRIES", 20000))
+# Stores per process between two trims of the disk tier, which may run
+# over DISK_ENTRIES by that many rows per worker in between
+DISK_TRIM_EVERY = int(os.getenv("LLM_CACHE_DISK_TRIM_EVERY", 100))
+
+# Seconds a response stays valid, per endpoint
+ENDPOINT_TTLS = {
+    "ideas": 24 * 3600,
+    "tasks": 3600,
+    "resources": 24 * 3600,
+    "chat": 600,
+}
+DEFAULT_TTL = 600
+
+_memory: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+_memory_lock = threading.Lock()
+# Calls in progress per key, so concurrent identical prompts make one API
+# call; the lock is only held to look up or register the future
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+_stats = Counter()
+_stats_lock = threading.Lock()
+_disk_puts = 0
+
+
+def _init_db():
+    with database.connection(CACHE_DB_PATH) as conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                last_hit REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_by_last_hit ON llm_cache (last_hit)")
+
+
+if ENABLED:
+    _init_db()
+
+
+def cache_key(model: str, messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:
+    prompt_hash = hashlib.sha256(
+        json.dumps(messages, sort_keys=True, ensure_ascii=False).encode()
+    ).hexdigest()
+    params_str = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(f"{model}\0{prompt_hash}\0{params_str}".encode()).hexdigest()
+
+
+def _count(endpoint: str, event: str):
+    with _stats_lock:
+        _stats[(endpoint, event)] += 1
+    bublikmetrics.LLM_CACHE.inc(endpoint=endpoint, event=event)
+
+
+def _memory_get(key: str, now: float):
+    with _memory_lock:
+        entry = _memory.get(key)
+        if entry is None:
+            return None
+        expires_at, response = entry
+        if expires_at <= now:
+            del _memory[key]
+            return None
+        _memory.move_to_end(key)
+        return response
+
+
+def _memory_put(key: str, response: str, expires_at: float):
+    with _memory_lock:
+        _memory[key] = (expires_at, response)
+        _memory.move_to_end(key)
+        while len(_memory) > MEMORY_ENTRIES:
+            _memory.popitem(last=False)
+
+
+def _disk_get(key: str, now: float):
+    with database.connection(CACHE_DB_PATH) as conn:
+        row = conn.execute(
+            "SELECT response, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?",
+            (key, now),
+        ).fetchone()
+        if row:
+            conn.execute("UPDATE llm_cache SET last_hit = ? WHERE key = ?", (now, key))
+    return row
+
+
+def _trim_disk(conn, now: float):
+    """
+    Drops expired rows and the least recently hit ones over DISK_ENTRIES.
+    Sorting the table is only paid for when the count is over the limit.
+    """
+    conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+    (rows,) = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+    if rows > DISK_ENTRIES:
+        conn.execute(
+            """
+            DELETE FROM llm_cache WHERE key IN (
+                SELECT key FROM llm_cache ORDER BY last_hit DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (DISK_ENTRIES,),
+        )
+
+
+def _disk_put(key: str, endpoint: str, model: str, response: str, now: float, expires_at: float):
+    global _disk_puts
+    with _stats_lock:
+        _disk_puts += 1
+        trim = _disk_puts % max(1, DISK_TRIM_EVERY) == 0
+    with database.connection(CACHE_DB_PATH) as conn:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO llm_cache
+                (key, endpoint, model, response, created_at, expires_at, last_hit)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (key, endpoint, model, response, now, expires_at, now),
+        )
+        if trim:
+            _trim_disk(conn, now)
+
+
+def lookup(endpoint: str, model: str, messages: List[Dict[str, str]], params: Dict[str, Any]):
+    """
+    Returns the cached response or None, without calling the API.
+    """
+    if not ENABLED:
+        return None
+    key = cache_key(model, messages, params)
+    now = time.time()
+    response = _memory_get(key, now)
+    if response is not None:
+        _count(endpoint, "memory_hit")
+        return response
+    row = _disk_get(key, now)
+    if row:
+        _count(endpoint, "disk_hit")
+        _memory_put(key, row[0], row[1])
+        return row[0]
+    _count(endpoint, "miss")
+    return None
+
+
+def store(endpoint: str, model: str, messages: List[Dict[str, str]], params: Dict[str, Any], response: str):
+    if not ENABLED or not response:
+        return
+    key = cache_key(model, messages, params)
+    now = time.time()
+    expires_at = now + ENDPOINT_TTLS.get(endpoint, DEFAULT_TTL)
+    _memory_put(key, response, expires_at)
+    _disk_put(key, endpoint, model, response, now, expires_at)
+
+
+def cached_completion(
+    endpoint: str,
+    model: str,
+    messages: List[Dict[str, str]],
+    params: Dict[str, Any],
+    create: Callable[[], str],
+) -> str:
+    """
+    Returns the cached response for this exact request, or calls `create()`
+    and stores what it returns. Empty responses and exceptions are not cached.
+    """
+    if not ENABLED:
+        return create()
+
+    key = cache_key(model, messages, params)
+    response = _memory_get(key, time.time())
+    if response is not None:
+        _count(endpoint, "memory_hit")
+        return response
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = _inflight[key] = Future()
+    if not owner:
+        # The same request is being made by another thread, share its result
+        _count(endpoint, "coalesced")
+        return future.result()
+
+    try:
+        response = lookup(endpoint, model, messages, params)
+        if response is None:
+            response = create()
+            store(endpoint, model, messages, params, response)
+        future.set_result(response)
+        return response
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    """
+    Hit/miss counters since the process started, per endpoint.
+    """
+    out: Dict[str, Dict[str, int]] = {}
+    with _stats_lock:
+        for (endpoint, event), n in _stats.items():
+            out.setdefault(endpoint, {"memory_hit": 0, "disk_hit": 0, "miss": 0, "coalesced": 0})[event] = n
+    return out
+
+
+def clear():
+    with _memory_lock:
+        _memory.clear()
+    if ENABLED:
+        with database.connection(CACHE_DB_PATH) as conn:
+            conn.execute("DELETE FROM llm_cache")
@@ -1,18 +1,17 @@
 # bublik.py
 
 import os
-import sqlite3
-from dotenv import load_dotenv
-from openai import OpenAI
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import database
+import bublikllm
+
+log = logging.getLogger(__name__)
 
 # ———————————————
-# 1) Load env & instantiate client
+# 1) The OpenAI client is shared, see bublikllm
 # ———————————————
-load_dotenv()
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise RuntimeError("Make sure .env contains OPENAI_API_KEY=…")
-client = OpenAI(api_key=api_key)
 
 # ———————————————
 # 2) Paths
@@ -24,41 +23,50 @@ CONVO_DB_PATH = "bublik_convo.db"  # our chat history
 # 3) Read project + roles from your existing users table
 # ———————————————
 
+def _answer_messages(question: str):
+    system_prompt = (
+        "You are a helpful assistant. "
+        "Answer the user’s question concisely and accurately."
+    )
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": question}
+    ]
+
+
 def get_answer(question: str) -> str:
     """
     Sends the user's question to the OpenAI chat endpoint and returns the assistant's answer.
     """
-    system_prompt = (
-        "You are a helpful assistant. "
-        "Answer the user’s question concisely and accurately."
+    return bublikllm.complete(
+        _answer_messages(question),
+        endpoint="chat",
+        max_tokens=500,
+        temperature=0.7
     )
-    resp = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": question}
-        ],
+
+
+def stream_answer(question: str, usage: dict = None):
+    """
+    Same answer as get_answer, yielded piece by piece as it is generated.
+    """
+    return bublikllm.stream(
+        _answer_messages(question),
+        endpoint="chat",
+        usage=usage,
         max_tokens=500,
         temperature=0.7
     )
-    return resp.choices[0].message.content.strip()
 
 
 
-def load_project_and_roles():
+def load_project_and_roles(pbl_group_number=None):
     """
-    Connect to your existing `my_database.db` and pull:
+    Pull from the users of `my_database.db` (of one PBL group if given):
       - project_name: assumed identical across all rows
       - roles: dict of {name: role}
     """
-    conn = sqlite3.connect(USER_DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        SELECT name, role, "Project name"
-        FROM users
-    ''')
-    rows = c.fetchall()
-    conn.close()
+    rows = database.get_roster(pbl_group_number)
     if not rows:
         raise RuntimeError("No users found in my_database.db → users table is empty.")
     # assume project name is the same on every row:
@@ -69,60 +77,203 @@ def load_project_and_roles():
 # ———————————————
 # 4) Convo history DB (we keep our own)
 # ———————————————
+# Token budget for the whole prompt sent by chat_with_context. The newest
+# turns that fit are sent verbatim, older ones are folded into a rolling
+# per-session summary by a background worker, so neither the prompt nor
+# the request latency grows with the conversation.
+CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", 1500))
+SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", 250))
+FOLD_BATCH = 40  # turns folded per summary call
+
+_summary_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="convo-summary")
+_folding: set = set()
+_folding_lock = threading.Lock()
+
+
 def init_convo_db():
-    conn = sqlite3.connect(CONVO_DB_PATH)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS convo (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            role TEXT NOT NULL,
-            content TEXT NOT NULL,
-            ts DATETIME DEFAULT CURRENT_TIMESTAMP
+    database.init_convo_db(CONVO_DB_PATH)
+
+def add_convo(role: str, content: str, session_id: str = "default"):
+    with database.connection(CONVO_DB_PATH) as conn:
+        conn.execute(
+            "INSERT INTO convo (role, content, session_id, tokens) VALUES (?, ?, ?, ?)",
+            (role, content, session_id, bublikllm.count_tokens(content)),
+        )
+
+def load_convo(session_id: str = "default", limit: int = 50):
+    """
+    The last `limit` messages of a session, oldest first.
+    """
+    with database.connection(CONVO_DB_PATH) as conn:
+        rows = conn.execute(
+            "SELECT role, content FROM convo WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+            (session_id, limit),
+        ).fetchall()
+    return [{"role": row[0], "content": row[1]} for row in reversed(rows)]
+
+def load_summary(session_id: str):
+    """
+    Returns (upto_id, summary, tokens), (0, "", 0) when nothing was folded yet.
+    """
+    with database.connection(CONVO_DB_PATH) as conn:
+        row = conn.execute(
+            "SELECT upto_id, summary, tokens FROM convo_summaries WHERE session_id = ?",
+            (session_id,),
+        ).fetchone()
+    return row or (0, "", 0)
+
+def build_context(session_id: str, system_msg: dict, user_text: str, budget: int = CONTEXT_TOKENS):
+    """
+    system message + rolling summary + the newest turns that fit in `budget`
+    + the new user message. Returns (messages, dropped_id), dropped_id is
+    the newest turn left out for lack of space (None if everything fit).
+    """
+    upto_id, summary, summary_tokens = load_summary(session_id)
+    user_msg = {"role": "user", "content": user_text}
+    used = bublikllm.count_message_tokens([system_msg, user_msg]) + summary_tokens + 4
+
+    kept = []
+    dropped_id = None
+    with database.connection(CONVO_DB_PATH) as conn:
+        rows = conn.execute(
+            """
+            SELECT id, role, content, tokens FROM convo
+            WHERE session_id = ? AND id > ? ORDER BY id DESC
+            """,
+            (session_id, upto_id),
+        )
+        for id, role, content, tokens in rows:
+            cost = (tokens if tokens is not None else bublikllm.count_tokens(content)) + 4
+            if used + cost > budget:
+                dropped_id = id
+                break
+            used += cost
+            kept.append({"role": role, "content": content})
+
+    messages = [system_msg]
+    if summary:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+    messages += reversed(kept)
+    messages.append(user_msg)
+    return messages, dropped_id
+
+def fold_old_turns(session_id: str, through_id: int):
+    """
+    Folds the turns after the current summary up to `through_id` into
+    the summary, FOLD_BATCH turns per model call.
+    """
+    while True:
+        upto_id, summary, _ = load_summary(session_id)
+        with database.connection(CONVO_DB_PATH) as conn:
+            rows = conn.execute(
+                """
+                SELECT id, role, content FROM convo
+                WHERE session_id = ? AND id > ? AND id <= ? ORDER BY id LIMIT ?
+                """,
+                (session_id, upto_id, through_id, FOLD_BATCH),
+            ).fetchall()
+        if not rows:
+            return
+
+        transcript = "\n".join(f"{role}: {content}" for _, role, content in rows)
+        new_summary = bublikllm.complete(
+            [
+                {
+                    "role": "system",
+                    "content": (
+                        "Update the running summary of a conversation with the new messages. "
+                        "Keep decisions, facts, names and open questions. Be brief."
+                    ),
+                },
+                {"role": "user", "content": f"Current summary:\n{summary or '(empty)'}\n\nNew messages:\n{transcript}"},
+            ],
+            endpoint="chat-summary",
+            max_tokens=SUMMARY_TOKENS,
+            temperature=0.2,
         )
-    """)
-    conn.commit()
-    conn.close()
-
-def add_convo(role: str, content: str):
-    conn = sqlite3.connect(CONVO_DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT INTO convo (role, content) VALUES (?, ?)", (role, content))
-    conn.commit()
-    conn.close()
-
-def load_convo():
-    conn = sqlite3.connect(CONVO_DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT role, content FROM convo ORDER BY id")
-    msgs = [{"role": row[0], "content": row[1]} for row in c.fetchall()]
-    conn.close()
-    return msgs
+        with database.connection(CONVO_DB_PATH) as conn:
+            conn.execute(
+                """
+                INSERT INTO convo_summaries (session_id, upto_id, summary, tokens) VALUES (?, ?, ?, ?)
+                ON CONFLICT (session_id) DO UPDATE SET
+                    upto_id = excluded.upto_id, summary = excluded.summary,
+                    tokens = excluded.tokens, updated_at = CURRENT_TIMESTAMP
+                """,
+                (session_id, rows[-1][0], new_summary, bublikllm.count_tokens(new_summary)),
+            )
+
+def _schedule_fold(session_id: str, through_id: int):
+    with _folding_lock:
+        if session_id in _folding:
+            return
+        _folding.add(session_id)
+
+    def run():
+        try:
+            fold_old_turns(session_id, through_id)
+        except Exception:
+            log.exception("Error summarizing conversation %s", session_id)
+        finally:
+            with _folding_lock:
+                _folding.discard(session_id)
+
+    _summary_pool.submit(run)
+
+init_convo_db()
 
 # ———————————————
 # 5) Chat helper
 # ———————————————
-def chat_with_context(user_text: str) -> str:
-    # turn the dict into a simple "Name: Role, ..." string
-
-    system_msg = {
-        "role": "system",
-        "content": (
-            "When asked for creative ideas, also propose a task repartition "
-            "based on roles. Remember the entire conversation."
-        )
-    }
+CHAT_SYSTEM_MSG = {
+    "role": "system",
+    "content": (
+        "When asked for creative ideas, also propose a task repartition "
+        "based on roles. Remember the entire conversation."
+    )
+}
 
+def _store_turn(session_id: str, user_text: str, assistant_text: str, dropped_id):
+    add_convo("user", user_text, session_id)
+    add_convo("assistant", assistant_text, session_id)
 
-    resp = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[system_msg],
+    # Turns that no longer fit the budget go into the summary, off the request path
+    if dropped_id is not None:
+        _schedule_fold(session_id, dropped_id)
+
+def chat_with_context(user_text: str, session_id: str = "default") -> str:
+    messages, dropped_id = build_context(session_id, CHAT_SYSTEM_MSG, user_text)
+
+    assistant_text = bublikllm.complete(
+        messages,
+        cache=False,
         max_tokens=500,
         temperature=0.8
     )
 
-    assistant_text = resp.choices[0].message.content.strip()
+    _store_turn(session_id, user_text, assistant_text, dropped_id)
     return assistant_text
 
+def stream_chat_with_context(user_text: str, session_id: str = "default", usage: dict = None):
+    """
+    Same as chat_with_context, yielded piece by piece as it is generated.
+    The turn is stored once the answer is complete; a stream that fails or
+    is closed early leaves the conversation as it was.
+    """
+    messages, dropped_id = build_context(session_id, CHAT_SYSTEM_MSG, user_text)
+
+    parts = []
+    for delta in bublikllm.stream(
+        messages,
+        cache=False,
+        usage=usage,
+        max_tokens=500,
+        temperature=0.8
+    ):
+        parts.append(delta)
+        yield delta
+
+    _store_turn(session_id, user_text, "".join(parts).strip(), dropped_id)
+
 # ———————————————
 # 6) Main loop
 # ———————————————
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+import database
+
+# ———————————————
+# Background jobs for slow AI generations
+# ———————————————
+# The route hands the work to a small pool and returns a job id at once,
+# so a slow generation holds a pool thread instead of a web worker.
+# Jobs and their results live in SQLite, so any worker can answer a poll
+# and results survive a restart.
+
+JOBS_DB_PATH = "bublik_jobs.db"
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+# A job still queued or running after this many seconds is reported as failed
+# (its process most likely died)
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", 600))
+# Finished jobs are kept this long
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", 24 * 3600))
+
+_pool = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="bublik-job")
+# Jobs of this process that have not finished yet, to wake up waiters
+_pending: Dict[str, threading.Event] = {}
+_pending_lock = threading.Lock()
+
+
+def _init_db():
+    with database.connection(JOBS_DB_PATH) as conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                params TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_by_created_at ON jobs (created_at)")
+
+
+_init_db()
+
+
+def _update(job_id: str, **fields):
+    columns = ", ".join(f"{k} = ?" for k in fields)
+    with database.connection(JOBS_DB_PATH) as conn:
+        conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+
+def _run(job_id: str, fn: Callable[..., Any], params: Dict[str, Any]):
+    _update(job_id, status="running", started_at=time.time())
+    try:
+        result = fn(**params)
+    except Exception as e:
+        _update(job_id, status="error", error=str(e) or type(e).__name__, finished_at=time.time())
+    else:
+        _update(job_id, status="done", result=json.dumps(result), finished_at=time.time())
+    finally:
+        with _pending_lock:
+            event = _pending.pop(job_id, None)
+        if event:
+            event.set()
+
+
+def submit(kind: str, fn: Callable[..., Any], **params: Any) -> str:
+    """
+    Queues fn(**params) and returns the job id. The result must be
+    JSON serializable, params are stored with the job.
+    """
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with database.connection(JOBS_DB_PATH) as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, status, params, created_at) VALUES (?, ?, 'queued', ?, ?)",
+            (job_id, kind, json.dumps(params), now),
+        )
+        conn.execute(
+            "DELETE FROM jobs WHERE created_at < ? AND status IN ('done', 'error')",
+            (now - JOB_RETENTION,),
+        )
+    with _pending_lock:
+        _pending[job_id] = threading.Event()
+    # In the submitter's context, so the job logs with its request id
+    _pool.submit(contextvars.copy_context().run, _run, job_id, fn, params)
+    return job_id
+
+
+def get(job_id: str) -> Optional[Dict[str, Any]]:
+    """
+    The job as {"job_id", "kind", "status", ...} with "result" once done
+    and "error" when it failed, or None for an unknown id.
+    """
+    with database.connection(JOBS_DB_PATH) as conn:
+        row = conn.execute(
+            """
+            SELECT id, kind, status, result, error, created_at, started_at, finished_at
+            FROM jobs WHERE id = ?
+            """,
+            (job_id,),
+        ).fetchone()
+    if row is None:
+        return None
+    id, kind, status, result, error, created_at, started_at, finished_at = row
+    if status in ("queued", "running") and time.time() - created_at > JOB_TIMEOUT:
+        status, error = "error", "Job timed out"
+    job = {"job_id": id, "kind": kind, "status": status, "created_at": created_at}
+    if started_at:
+        job["queued_ms"] = round((started_at - created_at) * 1000, 1)
+    if finished_at:
+        job["elapsed_ms"] = round((finished_at - created_at) * 1000, 1)
+    if status == "done":
+        job["result"] = json.loads(result)
+    if status == "error":
+        job["error"] = error
+    return job
+
+
+def wait(job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+    """
+    Like get() but waits up to `timeout` seconds for the job to finish.
+    Jobs of other processes are polled.
+    """
+    deadline = time.monotonic() + timeout
+    with _pending_lock:
+        event = _pending.get(job_id)
+    if event is not None:
+        event.wait(timeout)
+    while True:
+        job = get(job_id)
+        if job is None or job["status"] in ("done", "error"):
+            return job
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return job
+        time.sleep(min(0.25, remaining))
@@ -0,0 +1,264 @@
+import os
+import time
+import random
+import threading
+from typing import Dict, List, Any, Iterator
+from dotenv import load_dotenv
+from openai import OpenAI, APIConnectionError, APIStatusError, APITimeoutError
+
+import bublikcache
+import bublikmetrics
+
+try:
+    import tiktoken
+except ImportError:  # optional, token counts are estimated without it
+    tiktoken = None
+
+# ———————————————
+# Shared OpenAI client for bublikproblem, bublikresources and bublikchat
+# ———————————————
+# One client per process so HTTP connections are reused, a global slot
+# limit so a burst of requests queues here (and gives up after
+# QUEUE_TIMEOUT) instead of piling onto the API, and retries with
+# exponential backoff and jitter on 429, 5xx, timeouts and dropped connections.
+
+load_dotenv()
+API_KEY = os.getenv("OPENAI_API_KEY")
+DEFAULT_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+JSON_MODEL = os.getenv("OPENAI_JSON_MODEL", "gpt-3.5-turbo-1106")
+# Set to a local stand-in (bench_llm_server.py) for offline load tests
+BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", 30))
+REQUEST_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 0.5))
+BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", 20))
+
+_client = None
+_client_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_CONCURRENCY)
+_active = 0
+_active_lock = threading.Lock()
+
+
+_encodings = {}
+
+
+def count_tokens(text: str, model: str = None) -> int:
+    """
+    Exact with tiktoken installed, otherwise about 4 characters per token.
+    """
+    if tiktoken is None:
+        return (len(text) + 3) // 4
+    model = model or DEFAULT_MODEL
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("cl100k_base")
+    return len(_encodings[model].encode(text))
+
+
+def count_message_tokens(messages: List[Dict[str, str]], model: str = None) -> int:
+    # Every message costs a few tokens of framing on top of its content
+    return sum(count_tokens(m["content"], model) + 4 for m in messages) + 2
+
+
+def active_requests() -> int:
+    """
+    Slots in use right now, so background work can back off when busy.
+    """
+    return _active
+
+
+def _acquire():
+    global _active
+    if not _slots.acquire(timeout=QUEUE_TIMEOUT):
+        raise LLMBusyError("Too many AI requests in progress, please try again shortly.")
+    with _active_lock:
+        _active += 1
+
+
+def _release():
+    global _active
+    with _active_lock:
+        _active -= 1
+    _slots.release()
+
+
+class LLMBusyError(RuntimeError):
+    """
+    Raised when no slot frees up within QUEUE_TIMEOUT.
+    """
+
+
+def get_client() -> OpenAI:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if not API_KEY:
+                    raise RuntimeError("Make sure .env contains OPENAI_API_KEY")
+                # Retries are done here, not in the SDK, so they respect the slots
+                _client = OpenAI(
+                    api_key=API_KEY, base_url=BASE_URL, timeout=REQUEST_TIMEOUT, max_retries=0
+                )
+    return _client
+
+
+def _retryable(e: Exception) -> bool:
+    if isinstance(e, (APITimeoutError, APIConnectionError)):
+        return True
+    if isinstance(e, APIStatusError):
+        return e.status_code == 429 or e.status_code >= 500
+    return False
+
+
+def _backoff(attempt: int, e: Exception) -> float:
+    """
+    Full jitter, or the server's Retry-After when it sends one.
+    """
+    response = getattr(e, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def _error_label(e: Exception) -> str:
+    status = getattr(e, "status_code", None)
+    return str(status) if status else type(e).__name__
+
+
+def _create(endpoint: str, timeout: float, kwargs: dict):
+    """
+    The API call with retries, a slot must be held.
+    """
+    attempt = 0
+    while True:
+        try:
+            return get_client().chat.completions.create(timeout=timeout or REQUEST_TIMEOUT, **kwargs)
+        except Exception as e:
+            bublikmetrics.LLM_ERRORS.inc(model=kwargs.get("model"), endpoint=endpoint, error=_error_label(e))
+            if attempt >= MAX_RETRIES or not _retryable(e):
+                raise
+            time.sleep(_backoff(attempt, e))
+            attempt += 1
+
+
+def _record_usage(model: str, endpoint: str, usage):
+    if usage is None:
+        return
+    bublikmetrics.LLM_TOKENS.inc(usage.prompt_tokens or 0, model=model, endpoint=endpoint, kind="prompt")
+    bublikmetrics.LLM_TOKENS.inc(usage.completion_tokens or 0, model=model, endpoint=endpoint, kind="completion")
+
+
+def create_completion(timeout: float = None, endpoint: str = "default", **kwargs):
+    """
+    client.chat.completions.create with the slot limit, timeout and retries.
+    Returns the SDK response object (or stream when stream=True).
+    `endpoint` names the caller in the metrics.
+    """
+    with bublikmetrics.LLM_DURATION.time(model=kwargs.get("model"), endpoint=endpoint):
+        _acquire()
+        try:
+            response = _create(endpoint, timeout, kwargs)
+        finally:
+            _release()
+    if not kwargs.get("stream"):
+        _record_usage(kwargs.get("model"), endpoint, getattr(response, "usage", None))
+    return response
+
+
+def complete(
+    messages: List[Dict[str, str]],
+    model: str = None,
+    endpoint: str = "default",
+    cache: bool = True,
+    timeout: float = None,
+    **params: Any,
+) -> str:
+    """
+    Returns the stripped text of a chat completion.
+    `params` are passed to the API (max_tokens, temperature, response_format...).
+    With cache=True identical requests are answered from bublikcache.
+    """
+    model = model or DEFAULT_MODEL
+
+    def create() -> str:
+        resp = create_completion(timeout=timeout, endpoint=endpoint, model=model, messages=messages, **params)
+        return resp.choices[0].message.content.strip()
+
+    if not cache:
+        return create()
+    return bublikcache.cached_completion(endpoint, model, messages, params, create)
+
+
+def stream(
+    messages: List[Dict[str, str]],
+    model: str = None,
+    endpoint: str = "default",
+    cache: bool = True,
+    timeout: float = None,
+    usage: Dict[str, int] = None,
+    **params: Any,
+) -> Iterator[str]:
+    """
+    Like complete() but yields the text as the API produces it.
+    A cached response comes out as one piece. Only opening the stream is
+    retried, once text was sent it cannot be taken back. If `usage` is
+    given it is filled with the token counts reported by the API.
+    The slot is held until the generator finishes or is closed.
+    """
+    model = model or DEFAULT_MODEL
+    if cache:
+        hit = bublikcache.lookup(endpoint, model, messages, params)
+        if hit is not None:
+            yield hit
+            return
+
+    start = time.perf_counter()
+    outcome = "error"
+    _acquire()
+    try:
+        response = _create(endpoint, timeout, dict(
+            model=model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **params,
+        ))
+
+        parts = []
+        try:
+            for chunk in response:
+                if getattr(chunk, "usage", None):
+                    _record_usage(model, endpoint, chunk.usage)
+                    if usage is not None:
+                        usage["prompt_tokens"] = chunk.usage.prompt_tokens
+                        usage["completion_tokens"] = chunk.usage.completion_tokens
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+            outcome = "ok"
+        except GeneratorExit:
+            outcome = "cancelled"
+            raise
+        finally:
+            response.close()
+    finally:
+        _release()
+        bublikmetrics.LLM_DURATION.observe(
+            time.perf_counter() - start, model=model, endpoint=endpoint, outcome=outcome
+        )
+
+    if cache:
+        bublikcache.store(endpoint, model, messages, params, "".join(parts).strip())
@@ -0,0 +1,234 @@
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+import logging.handlers
+from typing import Dict, Optional
+
+# ———————————————
+# Structured, non-blocking logging
+# ———————————————
+# The modules log with logging.getLogger(__name__). Records go through a
+# bounded queue to a listener thread that formats and writes them, so a
+# request thread only pays for building the record; when the queue is
+# full records are dropped and counted instead of waiting.
+#
+# LOG_FORMAT=json (default) writes one JSON object per line with the
+# request id and any `extra=` fields, LOG_FORMAT=text is for a terminal.
+# DEBUG records are sampled per message: the first LOG_SAMPLE_BURST of a
+# message in every LOG_SAMPLE_WINDOW seconds pass, then 1 in
+# LOG_SAMPLE_EVERY.
+#
+# Imported first by the apps, it configures the root logger on import.
+
+LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+FORMAT = os.getenv("LOG_FORMAT", "json")
+FILE = os.getenv("LOG_FILE", "")
+QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", 10))
+SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", 100))
+SAMPLE_WINDOW = float(os.getenv("LOG_SAMPLE_WINDOW", 60))
+REQUEST_ID_HEADER = "X-Request-ID"
+
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+_dropped = 0
+_listener: Optional[logging.handlers.QueueListener] = None
+
+# Attributes every LogRecord has, anything else came in through extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+
+def request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def set_request_id(value: Optional[str]) -> contextvars.Token:
+    return _request_id.set(value)
+
+
+def dropped() -> int:
+    """
+    Records lost because the queue was full.
+    """
+    return _dropped
+
+
+class RequestIdFilter(logging.Filter):
+    # Runs in the thread that logs, where the context variable is set
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+
+class SampleFilter(logging.Filter):
+    """
+    Lets through the first `burst` DEBUG records of each message per
+    `window` seconds, then one in `every`. Sampled records carry
+    `sample_every` so counts can be scaled back.
+    """
+
+    def __init__(self, burst: int = SAMPLE_BURST, every: int = SAMPLE_EVERY, window: float = SAMPLE_WINDOW):
+        super().__init__()
+        self.burst = burst
+        self.every = max(1, every)
+        self.window = window
+        self._counts: Dict[tuple, int] = {}
+        self._window_start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        # The message template, not the formatted text, names the event
+        key = (record.name, str(record.msg))
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= self.window:
+                self._counts.clear()
+                self._window_start = now
+            n = self._counts[key] = self._counts.get(key, 0) + 1
+        if n <= self.burst:
+            return True
+        if (n - self.burst) % self.every:
+            return False
+        record.sample_every = self.every
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    converter = time.gmtime
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        entry["thread"] = record.threadName
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Keep the record structured for the formatter on the listener side:
+        # merge the args and render the traceback here (they may not
+        # survive the thread switch), but leave the formatting to it
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped += 1
+
+
+def configure(level: str = LEVEL, fmt: str = FORMAT, file: str = FILE):
+    """
+    Routes the root logger through the queue to stderr (or `file`).
+    Calling it again replaces the previous setup.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    target = logging.FileHandler(file) if file else logging.StreamHandler(sys.stderr)
+    if fmt == "json":
+        target.setFormatter(JsonFormatter())
+    else:
+        target.setFormatter(logging.Formatter("%(asctime)s %(levelname)-7s %(name)s [%(request_id)s] %(message)s"))
+
+    handler = _QueueHandler(queue.Queue(QUEUE_SIZE))
+    handler.addFilter(RequestIdFilter())
+    handler.addFilter(SampleFilter())
+
+    root = logging.getLogger()
+    for old in [h for h in root.handlers if isinstance(h, _QueueHandler)]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(handler.queue, target, respect_handler_level=True)
+    _listener.start()
+
+
+def _flush():
+    # Writes what is still queued at exit
+    if _listener is not None:
+        _listener.stop()
+
+
+configure()
+atexit.register(_flush)
+
+
+def instrument_app(app, name: str):
+    """
+    Gives every request of the Flask `app` an id (the incoming
+    X-Request-ID header or a new one) that is attached to its log records
+    and echoed in the response, and logs one line per finished request.
+    """
+    from flask import g, request
+
+    log = logging.getLogger(name)
+
+    @app.before_request
+    def _assign_request_id():
+        incoming = request.headers.get(REQUEST_ID_HEADER, "")
+        g.request_id = incoming[:64] if incoming else uuid.uuid4().hex
+        g.request_start = time.perf_counter()
+        set_request_id(g.request_id)
+
+    @app.after_request
+    def _log_request(response):
+        rid = g.get("request_id")
+        if rid is None:
+            return response
+        response.headers[REQUEST_ID_HEADER] = rid
+        start = g.request_start
+        method, path, status = request.method, request.path, response.status_code
+
+        def done():
+            # Streamed responses close after the request context is gone
+            token = set_request_id(rid)
+            try:
+                log.info(
+                    "%s %s %s",
+                    method,
+                    path,
+                    status,
+                    extra={"status": status, "duration_ms": round((time.perf_counter() - start) * 1000, 1)},
+                )
+            finally:
+                _request_id.reset(token)
+
+        response.call_on_close(done)
+        return response
+
+    @app.teardown_request
+    def _clear_request_id(exc):
+        set_request_id(None)
+
+    return app
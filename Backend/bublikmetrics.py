@@ -0,0 +1,219 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterable, Tuple
+
+# ———————————————
+# Metrics in the Prometheus text format, served at /metrics
+# ———————————————
+# Counters and histograms with labels, kept per process (every worker of
+# a multi-worker server exposes its own, scrape them all). No dependency
+# on prometheus_client, the exposition format is small enough.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = (1 << 10, 1 << 14, 1 << 17, 1 << 20, 1 << 23, 1 << 26, 1 << 29)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += self._samples()
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [count per bucket (non cumulative, last is +Inf), sum]
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the duration of the block; an `outcome` label, if the
+        histogram has one, is set to "error" when the block raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield labels
+        except BaseException:
+            if "outcome" in self.labelnames:
+                labels["outcome"] = "error"
+            raise
+        finally:
+            if "outcome" in self.labelnames:
+                labels.setdefault("outcome", "ok")
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1])) for k, v in self._values.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(m.render() for m in metrics) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# ———————————————
+# The metrics of the backend
+# ———————————————
+
+HTTP_DURATION = Histogram(
+    "bublik_http_request_duration_seconds",
+    "Time from request start until the response body was sent, by route.",
+    ("app", "method", "route", "status"),
+)
+LLM_DURATION = Histogram(
+    "bublik_llm_request_duration_seconds",
+    "Chat completion calls including retries, streams until the last chunk.",
+    ("model", "endpoint", "outcome"),
+)
+LLM_TOKENS = Counter(
+    "bublik_llm_tokens_total",
+    "Tokens reported by the API.",
+    ("model", "endpoint", "kind"),
+)
+LLM_ERRORS = Counter(
+    "bublik_llm_errors_total",
+    "Failed chat completion attempts, retried ones included.",
+    ("model", "endpoint", "error"),
+)
+LLM_CACHE = Counter(
+    "bublik_llm_cache_events_total",
+    "LLM response cache lookups.",
+    ("endpoint", "event"),
+)
+GIT_DURATION = Histogram(
+    "bublik_git_command_duration_seconds",
+    "git subprocesses, clone/fetch of mirrors and log runs.",
+    ("command", "outcome"),
+)
+GIT_OUTPUT = Histogram(
+    "bublik_git_output_bytes",
+    "Bytes read from git log.",
+    ("command",),
+    buckets=BYTES_BUCKETS,
+)
+DB_DURATION = Histogram(
+    "bublik_db_query_duration_seconds",
+    "database.connection() units of work, from taking a pooled connection to the commit, by calling function.",
+    ("function", "db", "outcome"),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5),
+)
+
+
+def instrument_app(app, name: str):
+    """
+    Records every request of the Flask `app` in HTTP_DURATION and adds the
+    /metrics route. Streamed responses are timed until the stream closes.
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _observe(response):
+        start = g.get("metrics_start")
+        if start is None:
+            return response
+        labels = {
+            "app": name,
+            "method": request.method,
+            "route": request.url_rule.rule if request.url_rule else "unmatched",
+            "status": response.status_code,
+        }
+        response.call_on_close(lambda: HTTP_DURATION.observe(time.perf_counter() - start, **labels))
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        return Response(render(), mimetype=None, content_type=CONTENT_TYPE)
+
+    return app
@@ -0,0 +1,153 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import bublikllm
+
+# ———————————————
+# Speculative distribute_tasks for freshly proposed ideas
+# ———————————————
+# After /api/ideas the user nearly always opens one of the ideas, so the
+# tasks for the first TOP_N can be generated while they read the list.
+# Results wait in a short-lived in-memory store that /api/tasks checks
+# first; a request that arrives while its speculation is already running
+# waits for it instead of starting a second generation. One that is still
+# queued is cancelled and the request generates the tasks itself.
+#
+# Speculation is low priority and capped: a small pool, at most
+# MAX_PENDING queued or running, at most PER_MINUTE started per minute,
+# and a queued one is dropped if the AI slots are more than half busy
+# when its turn comes.
+
+ENABLED = os.getenv("SPECULATIVE_TASKS", "0") == "1"  # default for requests that do not say
+TOP_N = int(os.getenv("SPECULATIVE_TOP_N", 3))
+TTL = float(os.getenv("SPECULATIVE_TTL", 300))
+WORKERS = int(os.getenv("SPECULATIVE_WORKERS", 2))
+MAX_PENDING = int(os.getenv("SPECULATIVE_MAX_PENDING", 6))
+PER_MINUTE = int(os.getenv("SPECULATIVE_PER_MINUTE", 30))
+
+_pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="speculate")
+_lock = threading.Lock()
+# (idea, group) -> (expires_at, future)
+_results: Dict[tuple, tuple] = {}
+_started = deque()  # start times within the last minute
+_pending = 0
+_stats = {"queued": 0, "skipped": 0, "dropped_busy": 0, "hits": 0, "waited": 0, "failed": 0, "cancelled": 0}
+
+
+class _Dropped(Exception):
+    pass
+
+
+def _key(idea: str, pbl_group_number) -> tuple:
+    return idea.strip(), None if pbl_group_number is None else str(pbl_group_number)
+
+
+def _purge(now: float):
+    for key in [k for k, (expires_at, _) in _results.items() if expires_at <= now]:
+        del _results[key]
+    while _started and _started[0] <= now - 60:
+        _started.popleft()
+
+
+def _run(generate: Callable[..., Dict[str, Any]], idea: str, pbl_group_number):
+    global _pending
+    try:
+        if bublikllm.active_requests() > bublikllm.MAX_CONCURRENCY // 2:
+            with _lock:
+                _stats["dropped_busy"] += 1
+            raise _Dropped()
+        result = generate(idea, pbl_group_number)
+        if not result.get("tasks"):
+            # The fallback bodies are not worth serving again
+            raise _Dropped()
+        return result
+    except Exception:
+        with _lock:
+            _results.pop(_key(idea, pbl_group_number), None)
+        raise
+    finally:
+        with _lock:
+            _pending -= 1
+
+
+def speculate(ideas: List[str], pbl_group_number, generate: Callable[..., Dict[str, Any]], top_n: int = None) -> int:
+    """
+    Queues generate(idea, pbl_group_number) for the first `top_n` ideas
+    within the budget. Returns how many were queued.
+    """
+    global _pending
+    queued = 0
+    now = time.time()
+    with _lock:
+        _purge(now)
+        for idea in ideas[:TOP_N if top_n is None else top_n]:
+            key = _key(idea, pbl_group_number)
+            if key in _results:
+                continue
+            if _pending >= MAX_PENDING or len(_started) >= PER_MINUTE:
+                _stats["skipped"] += 1
+                continue
+            _pending += 1
+            _started.append(now)
+            _stats["queued"] += 1
+            # The future is stored before it runs so a failure can remove it
+            future = Future()
+            _results[key] = (now + TTL, future)
+            queued += 1
+            _pool.submit(_chain, future, generate, idea, pbl_group_number)
+    return queued
+
+
+def _chain(future: Future, generate, idea: str, pbl_group_number):
+    global _pending
+    if not future.set_running_or_notify_cancel():
+        # take() cancelled it while it was queued
+        with _lock:
+            _pending -= 1
+        return
+    try:
+        future.set_result(_run(generate, idea, pbl_group_number))
+    except BaseException as e:
+        future.set_exception(e)
+
+
+def take(idea: str, pbl_group_number=None, timeout: float = None) -> Optional[Dict[str, Any]]:
+    """
+    The speculative result for this idea, waiting up to `timeout` seconds
+    (default the LLM request timeout) if it is being generated. None when
+    there is none, it failed, or it had not started yet: a queued one is
+    cancelled rather than waited for behind the other speculations.
+    """
+    key = _key(idea, pbl_group_number)
+    with _lock:
+        _purge(time.time())
+        entry = _results.get(key)
+    if entry is None:
+        return None
+    future = entry[1]
+    if future.cancel():
+        with _lock:
+            _stats["cancelled"] += 1
+            if _results.get(key) is entry:
+                del _results[key]
+        return None
+    waited = not future.done()
+    try:
+        result = future.result(timeout=bublikllm.REQUEST_TIMEOUT if timeout is None else timeout)
+    except Exception:
+        with _lock:
+            _stats["failed"] += 1
+        return None
+    with _lock:
+        _stats["hits"] += 1
+        _stats["waited"] += waited
+    return result
+
+
+def stats() -> Dict[str, int]:
+    with _lock:
+        return {**_stats, "pending": _pending, "stored": len(_results)}
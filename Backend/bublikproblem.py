@@ -1,76 +1,100 @@
+import database
+import bublikllm
 import os
-import sqlite3
 import json # Import json module
-from typing import List, Dict, Any # Add Any for flexible parsing
-from dotenv import load_dotenv
-from openai import OpenAI
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator, Optional, Tuple # Add Any for flexible parsing
 # from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 
-# Load environment variables and instantiate client
-load_dotenv()
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise RuntimeError("Make sure .env contains OPENAI_API_KEY")
-client = OpenAI(api_key=api_key)
+log = logging.getLogger(__name__)
 
 # Path to your existing user database
 db_path = "my_database.db"
 
 # --- Helper functions ---
-def load_roles() -> Dict[str, str]:
+def load_roles(pbl_group_number=None) -> Dict[str, str]:
     """
-    Load team roles from the users table.
+    Load team roles from the users table, of one PBL group if given.
     Returns a dict mapping user name to role.
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('SELECT name, role FROM users')
-    rows = cursor.fetchall()
-    conn.close()
-    return {name: role for name, role in rows}
+    return {name: role for name, role, _ in database.get_roster(pbl_group_number)}
 
 
-def ask_openai(system_prompt: str, user_prompt: str, max_tokens: int = 500, json_mode: bool = False) -> str:
+def ask_openai(system_prompt: str, user_prompt: str, max_tokens: int = 500, json_mode: bool = False, endpoint: str = "default") -> str:
     """
     Send a chat completion request to OpenAI and return the text response.
     Added json_mode parameter for structured output.
+    Identical requests are answered from bublikcache (TTL per `endpoint`).
     """
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt}
     ]
-    
-    response_format = {"type": "json_object"} if json_mode else {"type": "text"}
 
-    resp = client.chat.completions.create(
-        model="gpt-3.5-turbo-1106" if json_mode else "gpt-3.5-turbo", # Use a model that supports JSON mode if needed
-        messages=messages,
+    return bublikllm.complete(
+        messages,
+        model=bublikllm.JSON_MODEL if json_mode else bublikllm.DEFAULT_MODEL, # Use a model that supports JSON mode if needed
+        endpoint=endpoint,
         max_tokens=max_tokens,
         temperature=0.7, # Slightly lower temperature for more structured output
-        response_format=response_format # Specify response format
+        response_format={"type": "json_object"} if json_mode else {"type": "text"}, # Specify response format
     )
-    return resp.choices[0].message.content.strip()
 
 # --- Core logic functions ---
-def propose_ideas(problem: str, n_ideas: int = 5) -> List[str]:
-    """
-    Generate solution ideas for a given problem.
-    """
+def _ideas_prompts(problem: str, n_ideas: int):
     system_prompt = (
         f"You are a creative assistant. Given a short problem description, propose {n_ideas} different digital solution ideas."
     )
     user_prompt = f"Problem: {problem}\n\nPropose {n_ideas} solution ideas numbered 1 to {n_ideas}."
-    raw = ask_openai(system_prompt, user_prompt)
+    return system_prompt, user_prompt
+
+
+def _parse_idea_line(line: str) -> str:
+    parts = line.split('.', 1)
+    if len(parts) == 2 and parts[0].isdigit():
+        return parts[1].strip()
+    return line
+
+
+def propose_ideas(problem: str, n_ideas: int = 5) -> List[str]:
+    """
+    Generate solution ideas for a given problem.
+    """
+    system_prompt, user_prompt = _ideas_prompts(problem, n_ideas)
+    raw = ask_openai(system_prompt, user_prompt, endpoint="ideas")
     lines = [line.strip() for line in raw.splitlines() if line.strip()]
-    ideas = []
-    for line in lines:
-        parts = line.split('.', 1)
-        if len(parts) == 2 and parts[0].isdigit():
-            ideas.append(parts[1].strip())
-        else:
-            ideas.append(line)
-    return ideas
+    return [_parse_idea_line(line) for line in lines]
+
+
+def stream_ideas(problem: str, n_ideas: int = 5, usage: dict = None) -> Iterator[str]:
+    """
+    Same ideas as propose_ideas, each yielded as soon as its line is complete.
+    """
+    system_prompt, user_prompt = _ideas_prompts(problem, n_ideas)
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+    pending = ""
+    for delta in bublikllm.stream(
+        messages,
+        endpoint="ideas",
+        usage=usage,
+        max_tokens=500,
+        temperature=0.7,
+        response_format={"type": "text"},
+    ):
+        pending += delta
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            if line.strip():
+                yield _parse_idea_line(line.strip())
+    if pending.strip():
+        yield _parse_idea_line(pending.strip())
 
 # New structure for tasks
 # This should match the AiTask interface in your frontend
@@ -92,48 +116,265 @@ def propose_ideas(problem: str, n_ideas: int = 5) -> List[str]:
 #     tasks: List[AiTask]
 
 
-def distribute_tasks(idea: str) -> Dict[str, Any]:
+# Token budget for the distribute_tasks prompt. Over budget the example
+# block goes first, then the roles list is cut short.
+TASKS_PROMPT_TOKENS = int(os.getenv("TASKS_PROMPT_TOKENS", 1200))
+DEFAULT_ROLES = "Project Manager, Software Developer, Data Scientist, UX/UI Designer, Quality Assurance Tester"
+
+TASKS_INSTRUCTIONS = (
+    "You are an expert project manager assistant. Given a solution idea and team roles, "
+    "provide a concise overall analysis of the task distribution, and then "
+    "generate a list of specific tasks. Each task should include: "
+    "a 'title', 'description', 'assignedRole' (from the provided roles), "
+    "'priority' (low, medium, or high), 'estimatedDays' (an integer), and 'tags' (a list of relevant keywords)."
+    "\n\n"
+    "Return the response as a JSON object with two keys: 'analysis' (a string) and 'tasks' (an array of task objects)."
+)
+TASKS_EXAMPLE = (
+    "Example format for 'tasks' array:\n"
+    "[\n"
+    "  {\n"
+    "    \"title\": \"Develop User Authentication\",\n"
+    "    \"description\": \"Implement user login, registration, and session management.\",\n"
+    "    \"assignedRole\": \"Software Developer\",\n"
+    "    \"priority\": \"high\",\n"
+    "    \"estimatedDays\": 7,\n"
+    "    \"tags\": [\"backend\", \"security\"]\n"
+    "  }\n"
+    "]"
+)
+
+
+def tasks_prompts(idea: str, roles: Dict[str, str], budget: int = TASKS_PROMPT_TOKENS):
+    """
+    Builds the distribute_tasks system and user prompts within `budget`
+    tokens. Returns (system_prompt, user_prompt, info) where info holds the
+    token count and what had to be trimmed.
+    """
+    user_prompt = f"Solution idea: {idea}\n\nGenerate the analysis and task distribution."
+    entries = [f"{n} ({r})" for n, r in roles.items()] or [DEFAULT_ROLES]
+
+    def build(n_roles: int, example: bool) -> str:
+        roles_str = ", ".join(entries[:n_roles])
+        if n_roles < len(entries):
+            roles_str += f" and {len(entries) - n_roles} more"
+        parts = [TASKS_INSTRUCTIONS, "Available roles: " + roles_str]
+        if example:
+            parts.append(TASKS_EXAMPLE)
+        return "\n\n".join(parts)
+
+    def cost(system_prompt: str) -> int:
+        return bublikllm.count_message_tokens(
+            [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
+            bublikllm.JSON_MODEL,
+        )
+
+    # Keep the example while everything fits, then as many roles as fit
+    role_costs = [bublikllm.count_tokens(e + ", ", bublikllm.JSON_MODEL) for e in entries]
+    example = cost(build(len(entries), True)) <= budget
+    n_roles = len(entries)
+    if not example:
+        base = cost(build(0, False)) + bublikllm.count_tokens(f" and {len(entries)} more", bublikllm.JSON_MODEL)
+        used = 0
+        for n_roles, role_cost in enumerate(role_costs):
+            if base + used + role_cost > budget:
+                break
+            used += role_cost
+        else:
+            n_roles = len(entries)
+        n_roles = max(n_roles, 1)
+    system_prompt = build(n_roles, example)
+
+    info = {
+        "prompt_tokens": cost(system_prompt),
+        "budget": budget,
+        "roles": n_roles if roles else 0,
+        "roles_trimmed": len(entries) - n_roles,
+        "example_trimmed": not example,
+    }
+    return system_prompt, user_prompt, info
+
+
+def distribute_tasks(idea: str, pbl_group_number=None) -> Dict[str, Any]:
     """
     Generate task distribution and analysis based on roles for a chosen idea,
-    returning structured JSON.
+    returning structured JSON. With a PBL group only that group's members
+    go into the prompt. The result carries the token counts under "tokens".
     """
-    roles = load_roles()
+    roles = load_roles(pbl_group_number)
     if not roles:
         # Fallback if no roles are loaded, provide default or inform the user.
         # This is a critical point: ensure 'users' table in my_database.db has data.
-        print("Warning: No roles loaded from database. Using default roles for task distribution.")
-        roles_str = "Project Manager, Software Developer, Data Scientist, UX/UI Designer, Quality Assurance Tester"
-    else:
-        roles_str = ", ".join(f"{n} ({r})" for n, r in roles.items())
+        log.warning("No roles loaded from database. Using default roles for task distribution.")
 
-    system_prompt = (
-        "You are an expert project manager assistant. Given a solution idea and team roles, "
-        "provide a concise overall analysis of the task distribution, and then "
-        "generate a list of specific tasks. Each task should include: "
-        "a 'title', 'description', 'assignedRole' (from the provided roles), "
-        "'priority' (low, medium, or high), 'estimatedDays' (an integer), and 'tags' (a list of relevant keywords)."
-        "\n\n"
-        "Return the response as a JSON object with two keys: 'analysis' (a string) and 'tasks' (an array of task objects)."
-        "\n\n"
-        "Available roles: " + roles_str +
-        "\n\n"
-        "Example format for 'tasks' array:\n"
-        "[\n"
-        "  {\n"
-        "    \"title\": \"Develop User Authentication\",\n"
-        "    \"description\": \"Implement user login, registration, and session management.\",\n"
-        "    \"assignedRole\": \"Software Developer\",\n"
-        "    \"priority\": \"high\",\n"
-        "    \"estimatedDays\": 7,\n"
-        "    \"tags\": [\"backend\", \"security\"]\n"
-        "  }\n"
-        "]"
-    )
-    user_prompt = f"Solution idea: {idea}\n\nGenerate the analysis and task distribution."
+    system_prompt, user_prompt, tokens = tasks_prompts(idea, roles)
+    result, raw_json_response = _distribute_tasks(system_prompt, user_prompt)
+    tokens["completion_tokens"] = bublikllm.count_tokens(raw_json_response, bublikllm.JSON_MODEL)
+    result["tokens"] = tokens
+    return result
 
+
+def valid_task(task) -> bool:
+    """
+    True when `task` has every AiTask field with the right type.
+    """
+    return isinstance(task, dict) \
+        and all(k in task for k in ['title', 'description', 'assignedRole', 'priority', 'estimatedDays', 'tags']) \
+        and isinstance(task['title'], str) \
+        and isinstance(task['description'], str) \
+        and isinstance(task['assignedRole'], str) \
+        and task['priority'] in ['low', 'medium', 'high'] \
+        and isinstance(task['estimatedDays'], int) \
+        and isinstance(task['tags'], list)
+
+
+class TaskStreamParser:
+    """
+    Incremental parser for the {"analysis": "...", "tasks": [{...}, ...]}
+    response. feed() takes text as it arrives and returns the tasks whose
+    objects closed in it, already validated; malformed ones are counted in
+    `rejected` and the rest are kept. `analysis` is set once its string
+    closes, `complete` once the top-level object does, so a response cut
+    off at max_tokens still yields every task finished before the cut.
+    """
+
+    def __init__(self):
+        self.analysis: Optional[str] = None
+        self.tasks: List[Dict[str, Any]] = []
+        self.rejected = 0
+        self.complete = False
+        self._buf = []       # text of the value being captured
+        self._capturing = None  # "task" or "analysis"
+        self._depth = 0      # nesting of {} and []
+        self._stack = []     # "{" or "[" per level
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False  # in an object, before the key
+        self._key_chars = None    # collecting a top-level key
+        self._key = None          # last top-level key
+        self._in_tasks = False
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        closed = []
+        for ch in text:
+            if self._capturing:
+                self._buf.append(ch)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._key_chars is not None:
+                        self._key = "".join(self._key_chars)
+                        self._key_chars = None
+                    elif self._capturing == "analysis":
+                        self.analysis = self._finish()
+                elif self._key_chars is not None:
+                    self._key_chars.append(ch)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect_key:
+                    self._key_chars = []
+                    self._expect_key = False
+                elif self._depth == 1 and self._key == "analysis" and self._capturing is None:
+                    self._capturing = "analysis"
+                    self._buf = ['"']
+            elif ch in "{[":
+                if self._depth == 1 and ch == "[" and self._key == "tasks":
+                    self._in_tasks = True
+                elif self._depth == 2 and ch == "{" and self._in_tasks:
+                    self._capturing = "task"
+                    self._buf = ["{"]
+                self._stack.append(ch)
+                self._depth += 1
+                self._expect_key = ch == "{"
+            elif ch in "}]":
+                if not self._stack:
+                    continue
+                self._stack.pop()
+                self._depth -= 1
+                if self._depth == 2 and ch == "}" and self._capturing == "task":
+                    task = self._finish()
+                    if task is not None and valid_task(task):
+                        self.tasks.append(task)
+                        closed.append(task)
+                    else:
+                        self.rejected += 1
+                elif self._depth == 1 and ch == "]":
+                    self._in_tasks = False
+                elif self._depth == 0:
+                    self.complete = True
+                self._expect_key = False
+            elif ch == ",":
+                self._expect_key = bool(self._stack) and self._stack[-1] == "{"
+        return closed
+
+    def _finish(self):
+        text = "".join(self._buf)
+        self._buf = []
+        self._capturing = None
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return None
+
+
+def stream_tasks(idea: str, pbl_group_number=None, usage: dict = None) -> Iterator[Tuple[str, Any]]:
+    """
+    distribute_tasks over a streamed completion. Yields ("analysis", text)
+    and ("task", task) as each closes, then ("done", body) with the same
+    body distribute_tasks returns plus "truncated" and "rejected".
+    """
+    roles = load_roles(pbl_group_number)
+    system_prompt, user_prompt, tokens = tasks_prompts(idea, roles)
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+    parser = TaskStreamParser()
+    parts = []
+    for delta in bublikllm.stream(
+        messages,
+        model=bublikllm.JSON_MODEL,
+        endpoint="tasks",
+        usage=usage,
+        max_tokens=1000,
+        temperature=0.7,
+        response_format={"type": "json_object"},
+    ):
+        parts.append(delta)
+        had_analysis = parser.analysis is not None
+        for task in parser.feed(delta):
+            yield "task", task
+        if not had_analysis and parser.analysis is not None:
+            yield "analysis", parser.analysis
+
+    tokens["completion_tokens"] = bublikllm.count_tokens("".join(parts), bublikllm.JSON_MODEL)
+    if usage:
+        tokens["prompt_tokens"] = usage.get("prompt_tokens", tokens["prompt_tokens"])
+        tokens["completion_tokens"] = usage.get("completion_tokens", tokens["completion_tokens"])
+    yield "done", {
+        "analysis": parser.analysis or "",
+        "tasks": parser.tasks,
+        "truncated": not parser.complete,
+        "rejected": parser.rejected,
+        "tokens": tokens,
+    }
+
+
+def _distribute_tasks(system_prompt: str, user_prompt: str):
+    """
+    Returns (validated result, raw response).
+    """
+    raw_json_response = ""
     try:
-        raw_json_response = ask_openai(system_prompt, user_prompt, max_tokens=1000, json_mode=True)
-        # print(f"Raw AI JSON response: {raw_json_response}") # For debugging
+        raw_json_response = ask_openai(system_prompt, user_prompt, max_tokens=1000, json_mode=True, endpoint="tasks")
+        log.debug("Raw AI JSON response", extra={"chars": len(raw_json_response), "head": raw_json_response[:500]})
         parsed_data = json.loads(raw_json_response)
 
         # Basic validation of the parsed data structure
@@ -141,42 +382,48 @@ def distribute_tasks(idea: str) -> Dict[str, Any]:
             # Further validate tasks if necessary
             validated_tasks = []
             for task in parsed_data["tasks"]:
-                # Ensure all required fields are present and have correct types
-                if all(k in task for k in ['title', 'description', 'assignedRole', 'priority', 'estimatedDays', 'tags']) \
-                   and isinstance(task['title'], str) \
-                   and isinstance(task['description'], str) \
-                   and isinstance(task['assignedRole'], str) \
-                   and task['priority'] in ['low', 'medium', 'high'] \
-                   and isinstance(task['estimatedDays'], int) \
-                   and isinstance(task['tags'], list):
+                if valid_task(task):
                     validated_tasks.append(task)
                 else:
-                    print(f"Warning: Malformed task from AI, skipping: {task}")
+                    log.warning("Malformed task from AI, skipping it", extra={"task": task})
             
             return {
                 "analysis": parsed_data["analysis"],
                 "tasks": validated_tasks
-            }
+            }, raw_json_response
         else:
-            print(f"Warning: AI response missing 'analysis' or 'tasks' list. Raw: {raw_json_response}")
+            log.warning("AI response missing 'analysis' or 'tasks' list", extra={"head": raw_json_response[:500]})
             # Fallback for when AI doesn't return the expected structure
             return {
                 "analysis": "AI did not provide a structured analysis. Here is the raw response: " + raw_json_response,
                 "tasks": []
-            }
+            }, raw_json_response
 
     except json.JSONDecodeError as e:
-        print(f"JSON Decode Error: {e}. Raw response: {raw_json_response}")
+        # Usually cut off at max_tokens, keep the tasks that were complete
+        parser = TaskStreamParser()
+        parser.feed(raw_json_response)
+        if parser.tasks:
+            log.warning("AI response was not valid JSON (%s), kept %d complete tasks.", e, len(parser.tasks))
+            result = {"analysis": parser.analysis or "", "tasks": parser.tasks}
+            if not parser.complete:
+                # Cut off (usually at max_tokens), not just malformed
+                result["truncated"] = True
+            return result, raw_json_response
+        log.warning("JSON Decode Error: %s", e, extra={"head": raw_json_response[:500]})
         return {
             "analysis": "Failed to parse AI response as JSON. Please try again. Raw AI response: " + raw_json_response,
             "tasks": []
-        }
-    except Exception as e:
-        print(f"An unexpected error occurred during task distribution: {e}")
+        }, raw_json_response
+    except bublikllm.LLMBusyError:
+        # Not an internal error, the route answers 503 with Retry-After
+        raise
+    except Exception:
+        log.exception("An unexpected error occurred during task distribution")
         return {
             "analysis": "An internal error occurred while generating tasks.",
             "tasks": []
-        }
+        }, raw_json_response
 
 def recommend_resources(idea: str) -> str:
     """
@@ -196,4 +443,74 @@ def recommend_resources(idea: str) -> str:
         "Propose literature and resources:"
     )
 
-    return ask_openai(system_prompt, user_prompt, max_tokens=400)
+    return ask_openai(system_prompt, user_prompt, max_tokens=400, endpoint="resources")
+
+
+# --- Pipeline: ideas, then tasks and resources for the chosen ones ---
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", 8))
+_pipeline_pool = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="pipeline")
+
+
+def pipeline(
+    problem: str,
+    top_k: int = 1,
+    idea_index: Optional[int] = None,
+    pbl_group_number=None,
+    n_ideas: int = 5,
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Runs the whole ideas -> tasks + resources flow and yields (event, payload):
+      ("idea", {"index", "idea"})                   as each idea is generated
+      ("tasks", {"index", "idea", "tasks"})         distribute_tasks result
+      ("resources", {"index", "idea", "resources"}) recommend_resources result
+      ("error", {"stage", "index", "message"})      a stage failed, the others go on
+    Tasks and resources run for idea `idea_index`, or the first `top_k` ideas,
+    concurrently with each other and with the rest of the ideas, starting as
+    soon as that idea's line is complete.
+    """
+    events: "queue.Queue" = queue.Queue()
+    cancelled = threading.Event()
+
+    def run(stage: str, index: int, idea: str, fn):
+        try:
+            if not cancelled.is_set():
+                events.put((stage, {"index": index, "idea": idea, stage: fn()}))
+        except Exception as e:
+            events.put(("error", {"stage": stage, "index": index, "message": str(e)}))
+        finally:
+            events.put(None)
+
+    def wanted(index: int) -> bool:
+        return index == idea_index if idea_index is not None else index < top_k
+
+    def ideas_stage():
+        try:
+            for index, idea in enumerate(stream_ideas(problem, n_ideas)):
+                events.put(("idea", {"index": index, "idea": idea}))
+                if cancelled.is_set():
+                    break
+                if wanted(index):
+                    # Counted before submitting, so the consumer never sees 0 outstanding too early
+                    events.put(("_started", 2))
+                    _pipeline_pool.submit(run, "tasks", index, idea, lambda idea=idea: distribute_tasks(idea, pbl_group_number))
+                    _pipeline_pool.submit(run, "resources", index, idea, lambda idea=idea: recommend_resources(idea))
+        except Exception as e:
+            events.put(("error", {"stage": "ideas", "index": None, "message": str(e)}))
+        finally:
+            events.put(None)
+
+    outstanding = 1
+    # The ideas stream runs on its own thread, it must not wait behind the stages it starts
+    threading.Thread(target=ideas_stage, name="pipeline-ideas", daemon=True).start()
+    try:
+        while outstanding:
+            event = events.get()
+            if event is None:
+                outstanding -= 1
+            elif event[0] == "_started":
+                outstanding += event[1]
+            else:
+                yield event
+    finally:
+        # The client went away: stages not started yet are skipped
+        cancelled.set()
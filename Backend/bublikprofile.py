@@ -0,0 +1,242 @@
+import os
+import re
+import sys
+import time
+import heapq
+import random
+import threading
+import itertools
+from collections import Counter
+from typing import Dict, List, Optional
+
+# ———————————————
+# Sampled per-request profiling
+# ———————————————
+# Off unless PROFILE=1. Then a fraction PROFILE_RATE of the requests, and
+# every request carrying the PROFILE_HEADER (with PROFILE_TOKEN as value
+# when that is set), is profiled: one sampler thread reads the stack of
+# the request threads every PROFILE_INTERVAL_MS via sys._current_frames(),
+# so the request itself runs untouched and unprofiled requests pay only
+# the coin flip. Streamed responses are sampled until the stream closes.
+#
+# Each profile is written to PROFILE_DIR in the collapsed-stack format
+# ("frame;frame;frame count" per line) that flamegraph.pl, speedscope and
+# inferno read. The PROFILE_SLOWEST slowest stay in memory and are served
+# at /debug/profiles. Work handed to a thread pool (pipeline, prefetch,
+# jobs) shows up as the request thread waiting on its future.
+
+ENABLED = os.getenv("PROFILE", "0") == "1"
+RATE = float(os.getenv("PROFILE_RATE", 0.01))
+HEADER = os.getenv("PROFILE_HEADER", "X-Bublik-Profile")
+TOKEN = os.getenv("PROFILE_TOKEN", "")
+INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", 5)) / 1000
+DIR = os.getenv("PROFILE_DIR", "profiles")
+SLOWEST = int(os.getenv("PROFILE_SLOWEST", 20))
+# Oldest profile files are removed beyond this many
+MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", 500))
+# Deepest frames kept per sample, the rest of the stack is cut at the root
+MAX_DEPTH = 128
+
+_ids = itertools.count(1)
+_lock = threading.Lock()
+# thread ident -> Profile being recorded
+_active: Dict[int, "Profile"] = {}
+_wakeup = threading.Condition(_lock)
+_sampler: Optional[threading.Thread] = None
+# min-heap of (duration, id, Profile), the SLOWEST slowest finished ones
+_slowest: List[tuple] = []
+
+
+class Profile:
+    def __init__(self, app: str, method: str, path: str, route: str, reason: str):
+        self.id = f"{int(time.time())}-{next(_ids)}"
+        self.app = app
+        self.method = method
+        self.path = path
+        self.route = route
+        self.reason = reason
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.status = None
+        self.stacks: Counter = Counter()
+        self.file = None
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "app": self.app,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "reason": self.reason,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 1) if self.duration is not None else None,
+            "samples": sum(self.stacks.values()),
+            "file": self.file,
+        }
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _stack(frame) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    # Root first, the collapsed format puts the leaf last
+    return ";".join(reversed(names))
+
+
+def _sample_loop():
+    while True:
+        with _lock:
+            while not _active:
+                _wakeup.wait()
+            targets = list(_active.items())
+        frames = sys._current_frames()
+        samples = [(ident, profile, _stack(frames[ident])) for ident, profile in targets if ident in frames]
+        del frames
+        with _lock:
+            # A request that finished meanwhile keeps the stacks it had
+            for ident, profile, stack in samples:
+                if _active.get(ident) is profile:
+                    profile.stacks[stack] += 1
+        time.sleep(INTERVAL)
+
+
+def _ensure_sampler():
+    global _sampler
+    if _sampler is None:
+        _sampler = threading.Thread(target=_sample_loop, name="bublik-profiler", daemon=True)
+        _sampler.start()
+
+
+def start(app: str, method: str, path: str, route: str, reason: str) -> Profile:
+    """
+    Starts sampling the calling thread.
+    """
+    profile = Profile(app, method, path, route, reason)
+    with _lock:
+        _ensure_sampler()
+        _active[threading.get_ident()] = profile
+        _wakeup.notify()
+    return profile
+
+
+def _file_name(profile: Profile) -> str:
+    route = re.sub(r"[^A-Za-z0-9]+", "_", profile.route).strip("_") or "root"
+    return os.path.join(DIR, f"{profile.app}-{profile.id}-{route}-{round(profile.duration * 1000)}ms.folded")
+
+
+def _write(profile: Profile):
+    os.makedirs(DIR, exist_ok=True)
+    path = _file_name(profile)
+    with open(path, "w") as f:
+        f.write(profile.collapsed())
+    profile.file = path
+    files = sorted(
+        (os.path.join(DIR, name) for name in os.listdir(DIR) if name.endswith(".folded")),
+        key=os.path.getmtime,
+    )
+    for old in files[:-MAX_FILES] if MAX_FILES > 0 else []:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+
+
+def finish(profile: Profile, ident: int, status: int = None):
+    """
+    Stops sampling `ident`, writes the profile and keeps it if it is
+    among the slowest.
+    """
+    profile.duration = time.perf_counter() - profile.start
+    profile.status = status
+    with _lock:
+        if _active.get(ident) is profile:
+            del _active[ident]
+    try:
+        _write(profile)
+    except OSError:
+        # A read-only or full disk must not fail the request
+        pass
+    with _lock:
+        entry = (profile.duration, profile.id, profile)
+        if len(_slowest) < SLOWEST:
+            heapq.heappush(_slowest, entry)
+        elif SLOWEST > 0 and entry[0] > _slowest[0][0]:
+            heapq.heapreplace(_slowest, entry)
+
+
+def slowest() -> List[Profile]:
+    with _lock:
+        return [p for _, _, p in sorted(_slowest, reverse=True)]
+
+
+def get(profile_id: str) -> Optional[Profile]:
+    with _lock:
+        return next((p for _, pid, p in _slowest if pid == profile_id), None)
+
+
+def _reason(request) -> Optional[str]:
+    value = request.headers.get(HEADER)
+    if value is not None and (not TOKEN or value == TOKEN):
+        return "header"
+    if RATE > 0 and random.random() < RATE:
+        return "sampled"
+    return None
+
+
+def instrument_app(app, name: str):
+    """
+    With PROFILE=1, profiles the chosen requests of the Flask `app` and
+    adds /debug/profiles (the slowest, as JSON) and
+    /debug/profiles/<id> (one of them, collapsed stacks as text).
+    The profile id is returned in the X-Profile-Id response header.
+    """
+    if not ENABLED:
+        return app
+    from flask import Response, g, jsonify, request
+
+    skip = {"/metrics", "/debug/profiles", "/debug/profiles/<profile_id>"}
+
+    @app.before_request
+    def _start_profile():
+        if request.url_rule is not None and request.url_rule.rule in skip:
+            return
+        reason = _reason(request)
+        if reason is None:
+            return
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        g.profile = start(name, request.method, request.path, route, reason)
+
+    @app.after_request
+    def _finish_profile(response):
+        profile = g.get("profile")
+        if profile is None:
+            return response
+        ident = threading.get_ident()
+        status = response.status_code
+        response.headers["X-Profile-Id"] = profile.id
+        response.call_on_close(lambda: finish(profile, ident, status))
+        return response
+
+    @app.route("/debug/profiles", methods=["GET"])
+    def list_profiles():
+        return jsonify({"results": [p.summary() for p in slowest()]})
+
+    @app.route("/debug/profiles/<profile_id>", methods=["GET"])
+    def get_profile(profile_id: str):
+        profile = get(profile_id)
+        if profile is None:
+            return jsonify({"status": "error", "message": "Unknown or evicted profile"}), 404
+        return Response(profile.collapsed(), mimetype="text/plain")
+
+    return app
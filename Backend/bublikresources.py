@@ -1,68 +1,55 @@
-import os
 import sqlite3
+import logging
+import database
+import bublikllm
 import json
 import re # NEW: Import the re module for regular expressions
 from typing import List, Dict, Any
-from dotenv import load_dotenv
-from openai import OpenAI
-
-# Load environment variables and instantiate client
-load_dotenv()
-api_key = os.getenv("OPENAI_API_KEY")
-
-# --- DEBUGGING START ---
-print(f"DEBUG: OPENAI_API_KEY loaded: {'*****' if api_key else 'None'}")
-if not api_key:
-    print("DEBUG: WARNING: OPENAI_API_KEY not found. OpenAI calls will fail.")
-    client = None
-else:
-    client = OpenAI(api_key=api_key)
-# --- DEBUGGING END ---
+
+log = logging.getLogger(__name__)
+
+if not bublikllm.API_KEY:
+    log.warning("OPENAI_API_KEY not found. OpenAI calls will fail.")
 
 # Path to your existing user database
 db_path = "my_database.db"
 
 # --- Helper functions ---
-def load_roles() -> Dict[str, str]:
-    conn = None
+def load_roles(pbl_group_number=None) -> Dict[str, str]:
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT name, role FROM users')
-        rows = cursor.fetchall()
-        return {name: role for name, role in rows}
+        return {name: role for name, role, _ in database.get_roster(pbl_group_number)}
     except sqlite3.Error as e:
-        print(f"DEBUG: Database error in load_roles: {e}")
+        log.error("Database error in load_roles: %s", e)
         return {}
-    finally:
-        if conn:
-            conn.close()
 
 
-def ask_openai(system_prompt: str, user_prompt: str, max_tokens: int = 300) -> str:
-    if not client:
-        print("DEBUG: OpenAI client not initialized (API key missing or other error). Skipping API call.")
+def ask_openai(system_prompt: str, user_prompt: str, max_tokens: int = 300, endpoint: str = "default") -> str:
+    if not bublikllm.API_KEY:
+        log.warning("OpenAI client not initialized (API key missing). Skipping API call.", extra={"endpoint": endpoint})
         return ""
 
     try:
-        print("DEBUG: Calling OpenAI API...")
-        print(f"DEBUG: System Prompt: {system_prompt[:100]}...")
-        print(f"DEBUG: User Prompt: {user_prompt[:100]}...")
+        log.debug(
+            "Calling OpenAI API",
+            extra={"endpoint": endpoint, "system_prompt": system_prompt[:100], "user_prompt": user_prompt[:100]},
+        )
 
-        resp = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
+        raw_openai_response = bublikllm.complete(
+            [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt}
             ],
+            endpoint=endpoint,
             max_tokens=max_tokens,
             temperature=0.8
         )
-        raw_openai_response = resp.choices[0].message.content.strip()
-        print(f"DEBUG: Raw OpenAI response (first 200 chars): {raw_openai_response[:200]}...")
+        log.debug("OpenAI response", extra={"endpoint": endpoint, "chars": len(raw_openai_response), "head": raw_openai_response[:200]})
         return raw_openai_response
+    except bublikllm.LLMBusyError:
+        # Not an empty answer, the route answers 503 with Retry-After
+        raise
     except Exception as e:
-        print(f"DEBUG: Error calling OpenAI API: {e}")
+        log.error("Error calling OpenAI API: %s", e, extra={"endpoint": endpoint})
         return ""
 
 # --- Core logic functions ---
@@ -71,7 +58,7 @@ def propose_ideas(problem: str, n_ideas: int = 5) -> List[str]:
         f"You are a creative assistant. Given a short problem description, propose {n_ideas} different digital solution ideas."
     )
     user_prompt = f"Problem: {problem}\n\nPropose {n_ideas} solution ideas numbered 1 to {n_ideas}."
-    raw = ask_openai(system_prompt, user_prompt)
+    raw = ask_openai(system_prompt, user_prompt, endpoint="ideas")
     lines = [line.strip() for line in raw.splitlines() if line.strip()]
     ideas = []
     for line in lines:
@@ -83,8 +70,8 @@ def propose_ideas(problem: str, n_ideas: int = 5) -> List[str]:
     return ideas
 
 
-def distribute_tasks(idea: str) -> str:
-    roles = load_roles()
+def distribute_tasks(idea: str, pbl_group_number=None) -> str:
+    roles = load_roles(pbl_group_number)
     roles_str = ", ".join(f"{n}: {r}" for n, r in roles.items())
     if not roles_str:
         roles_str = "no specific roles defined in the database."
@@ -93,7 +80,7 @@ def distribute_tasks(idea: str) -> str:
         f"You are a project manager assistant for a team with roles: {roles_str}."
     )
     user_prompt = f"Solution idea: {idea}\n\nPropose task distribution among the team members based on their roles."
-    return ask_openai(system_prompt, user_prompt, max_tokens=400)
+    return ask_openai(system_prompt, user_prompt, max_tokens=400, endpoint="tasks")
 
 
 def get_resources(idea: str) -> List[Dict[str, str]]:
@@ -110,12 +97,10 @@ def get_resources(idea: str) -> List[Dict[str, str]]:
         )
     user_prompt = f"Solution idea: {idea}\n\nPropose literature and resources:"
 
-    json_string_from_openai = ask_openai(system_prompt, user_prompt, max_tokens=1000)
-
-    print(f"DEBUG: get_resources - JSON string from OpenAI (before fix): {json_string_from_openai[:500]}...")
+    json_string_from_openai = ask_openai(system_prompt, user_prompt, max_tokens=1000, endpoint="resources")
 
     if not json_string_from_openai:
-        print("DEBUG: OpenAI returned an empty response for resources.")
+        log.warning("OpenAI returned an empty response for resources.")
         return []
 
     # NEW: Replace single quotes around property names with double quotes
@@ -129,8 +114,8 @@ def get_resources(idea: str) -> List[Dict[str, str]]:
         # It doesn't handle single quotes within values correctly, but LLMs usually
         # escape those if generating valid JSON.
         corrected_json_string = re.sub(r"([{,]\s*)'([^']+)'(\s*:)", r'\1"\2"\3', json_string_from_openai)
-        
-        print(f"DEBUG: get_resources - JSON string after quote fix: {corrected_json_string[:500]}...")
+        if corrected_json_string != json_string_from_openai:
+            log.debug("Fixed single-quoted keys in the resources JSON", extra={"head": corrected_json_string[:500]})
 
         parsed_resources: List[Dict[str, str]] = json.loads(corrected_json_string)
 
@@ -143,17 +128,19 @@ def get_resources(idea: str) -> List[Dict[str, str]]:
                     'description' in item and isinstance(item['description'], str)):
                     validated_resources.append(item)
                 else:
-                    print(f"DEBUG: Warning: OpenAI returned an invalid resource item structure. Skipping: {item}")
-            print(f"DEBUG: Successfully parsed and validated {len(validated_resources)} resources.")
+                    log.warning("OpenAI returned an invalid resource item, skipping it", extra={"item": item})
+            log.debug("Parsed %d resources", len(validated_resources))
             return validated_resources
         else:
-            print(f"DEBUG: Warning: OpenAI did not return a JSON list for resources. Raw response: {corrected_json_string}")
+            log.warning("OpenAI did not return a JSON list for resources", extra={"head": corrected_json_string[:500]})
             return []
     except json.JSONDecodeError as e:
-        print(f"DEBUG: Error decoding JSON from OpenAI response (after fix): {e}")
-        print(f"DEBUG: Raw OpenAI response that caused error: '{json_string_from_openai}'")
-        print(f"DEBUG: Corrected JSON string that failed: '{corrected_json_string}'") # Print corrected string for more insight
+        log.warning(
+            "Error decoding the resources JSON (after the quote fix): %s",
+            e,
+            extra={"raw": json_string_from_openai[:500], "corrected": corrected_json_string[:500]},
+        )
         return []
-    except Exception as e:
-        print(f"DEBUG: An unexpected error occurred while processing OpenAI response: {e}")
+    except Exception:
+        log.exception("An unexpected error occurred while processing the resources response")
         return []
\ No newline at end of file
@@ -1,4 +1,20 @@
+import os
+import sys
+import json
+import queue
+import logging
+import hashlib
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from gitParser import Commit, FileStat
+import bublikmetrics
+
+log = logging.getLogger(__name__)
+
+DB_PATH = "my_database.db"
 
 
 class User:
@@ -51,100 +67,398 @@ class Task:
             yield key, getattr(self, key)
 
 
-# 1. Connect to the existing database (or create it if missing)
-conn = sqlite3.connect("my_database.db")
-cursor = conn.cursor()
+# 1. Shared connection layer
+# Connections are pooled per database file and handed out one per unit of
+# work, so threads never share a connection or a cursor. WAL lets readers
+# run while a write is in progress and busy_timeout makes writers wait for
+# each other instead of failing with "database is locked". Each connection
+# keeps its own prepared statement cache, which survives between requests
+# because the connection goes back to the pool.
+BUSY_TIMEOUT = float(os.environ.get("SQLITE_BUSY_TIMEOUT", 5))
+POOL_SIZE = int(os.environ.get("SQLITE_POOL_SIZE", 16))
+STATEMENT_CACHE = 256
+
+_pools: dict[str, queue.LifoQueue] = {}
+_pools_guard = threading.Lock()
+
+
+# Fields that make a task a duplicate, see task_hash
+TASK_HASH_FIELDS = ("title", "description", "assigned_to", "status", "priority")
+
 
-# 2. (Development only) Drop the old users table if it exists
-#    Comment out the next line if you want to preserve existing data.
-# cursor.execute("DROP TABLE IF EXISTS users")
+def _hash_task_fields(*fields) -> str:
+    canonical = json.dumps([" ".join(str(f or "").split()) for f in fields], ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
 
-# 3. Create the users table with the correct schema, including github_url
-cursor.execute(
+
+def connect(path: str = DB_PATH, journal_mode: str = "wal") -> sqlite3.Connection:
     """
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY,
-        name TEXT NOT NULL,
-        "Academic group" TEXT NOT NULL,
-        "PBL group number" TEXT NOT NULL,
-        email TEXT UNIQUE NOT NULL,
-        role TEXT NOT NULL,
-        password TEXT NOT NULL,
-        "Project name" TEXT NOT NULL,
-        github_url TEXT          -- new column for GitHub URL
-    )
-"""
-)
-
-cursor.execute( """
-    CREATE TABLE IF NOT EXISTS tasks (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT NOT NULL,
-        description TEXT NOT NULL,
-        assigned_to TEXT NOT NULL,
-        status TEXT NOT NULL,
-        priority TEXT NOT NULL,
-        due_date DATE NOT NULL,
-        hash TEXT NOT NULL UNIQUE
+    Opens a new configured connection, usually through connection() instead.
+    """
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE,
     )
+    conn.execute(f"PRAGMA journal_mode={journal_mode}")
+    conn.execute(f"PRAGMA busy_timeout={int(BUSY_TIMEOUT * 1000)}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    # task_hash(title, description, assigned_to, status, priority) in SQL
+    conn.create_function("task_hash", len(TASK_HASH_FIELDS), _hash_task_fields, deterministic=True)
+    return conn
+
+
+def _pool_for(path: str) -> queue.LifoQueue:
+    with _pools_guard:
+        return _pools.setdefault(path, queue.LifoQueue(maxsize=POOL_SIZE))
+
+
+@contextmanager
+def connection(path: str = DB_PATH):
+    """
+    Borrows a pooled connection to `path`. Commits when the block exits
+    normally and rolls back on an exception.
+        with connection() as conn:
+            conn.execute(...)
     """
-)
+    # Every unit of work is timed under the function that opened it
+    # (frame 1 is contextlib's __enter__), generators until they finish
+    function = sys._getframe(2).f_code.co_name
+    start = time.perf_counter()
+    outcome = "error"
+    pool = _pool_for(path)
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = connect(path)
 
-conn.commit()
+    try:
+        yield conn
+        if conn.in_transaction:
+            conn.commit()
+        outcome = "ok"
+    except GeneratorExit:
+        # The consumer of a generator stopped early
+        outcome = "cancelled"
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        try:
+            pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+        bublikmetrics.DB_DURATION.observe(
+            time.perf_counter() - start, function=function, db=os.path.basename(path), outcome=outcome
+        )
 
 
-# 4. sign_in remains unchanged
-def sign_in(user: User):
-    # Check if a user with the same email already exists
-    cursor.execute("SELECT 1 FROM users WHERE email = ?", (user.email,))
-    if cursor.fetchone():
-        print(f"User with email '{user.email}' already exists.")
-        return
-
-    # Check if that role is already taken
-    cursor.execute("SELECT 1 FROM users WHERE role = ?", (user.role,))
-    if cursor.fetchone():
-        print(f"The role '{user.role}' is already taken. Please select another role.")
-        return
-
-    # Insert the new user (github_url will default to NULL)
+def create_schema(conn: sqlite3.Connection):
+    """
+    Creates the base tables (no-op if they already exist).
+    Changes to existing tables go in MIGRATIONS instead.
+    """
+    cursor = conn.cursor()
+
+    # 2. (Development only) Drop the old users table if it exists
+    #    Comment out the next line if you want to preserve existing data.
+    # cursor.execute("DROP TABLE IF EXISTS users")
+
+    # 3. Create the users table with the correct schema, including github_url
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            "Academic group" TEXT NOT NULL,
+            "PBL group number" TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            role TEXT NOT NULL,
+            password TEXT NOT NULL,
+            "Project name" TEXT NOT NULL,
+            github_url TEXT          -- new column for GitHub URL
+        )
+    """
+    )
+
+    cursor.execute( """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            description TEXT NOT NULL,
+            assigned_to TEXT NOT NULL,
+            status TEXT NOT NULL,
+            priority TEXT NOT NULL,
+            due_date DATE NOT NULL,
+            hash TEXT NOT NULL UNIQUE
+        )
+        """
+    )
+
+    # Commit index, one row per (group, commit) so /git/<group> does not
+    # have to run git log over the whole history on every request
     cursor.execute(
         """
-        INSERT INTO users (
-            name,
-            "Academic group",
-            "PBL group number",
-            email,
-            role,
-            password,
-            "Project name",
-            github_url
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """,
-        (
-            user.name,
-            user.academic_group,
-            user.pbl_group_number,
-            user.email,
-            user.role,
-            user.password,
-            user.project_name,
-            user.github_url,
-        ),
+        CREATE TABLE IF NOT EXISTS commits (
+            group_number TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            seq INTEGER NOT NULL,          -- higher is newer, git log order
+            parents TEXT NOT NULL,         -- space separated hashes
+            author TEXT NOT NULL,
+            email TEXT NOT NULL,
+            author_time INTEGER NOT NULL,
+            committer TEXT NOT NULL,
+            committer_email TEXT NOT NULL,
+            commit_time INTEGER NOT NULL,
+            message TEXT NOT NULL,
+            insertions INTEGER NOT NULL,
+            deletions INTEGER NOT NULL,
+            PRIMARY KEY (group_number, hash)
+        )
+        """
     )
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS commit_files (
+            group_number TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            path TEXT NOT NULL,
+            old_path TEXT,
+            insertions INTEGER,            -- NULL for binary files
+            deletions INTEGER,
+            FOREIGN KEY (group_number, hash) REFERENCES commits (group_number, hash)
+        )
+        """
+    )
+
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS commit_files_by_commit ON commit_files (group_number, hash)"
+    )
+
+    # Keyset pagination walks seq, the path filter looks files up by prefix
+    cursor.execute("CREATE INDEX IF NOT EXISTS commits_by_seq ON commits (group_number, seq)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS commit_files_by_path ON commit_files (group_number, path)")
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS commit_heads (
+            group_number TEXT PRIMARY KEY,
+            head TEXT NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+
+# Schema migrations, applied in order on top of create_schema.
+# The applied version is kept in PRAGMA user_version. Never edit an entry
+# that has shipped, add a new one.
+MIGRATIONS = [
+    (
+        1,
+        "Indexes for the users and tasks lookups",
+        [
+            'CREATE INDEX IF NOT EXISTS users_by_pbl_group ON users ("PBL group number")',
+            "CREATE INDEX IF NOT EXISTS users_by_role ON users (role)",
+            "CREATE INDEX IF NOT EXISTS tasks_by_assignee ON tasks (assigned_to, status)",
+            "CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks (status)",
+            "CREATE INDEX IF NOT EXISTS tasks_by_due_date ON tasks (due_date)",
+        ],
+    ),
+    (
+        2,
+        "Version counter bumped on every users write, for the roster cache",
+        [
+            "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+            "INSERT OR IGNORE INTO counters (name, value) VALUES ('users', 0)",
+            """
+            CREATE TRIGGER IF NOT EXISTS users_version_insert AFTER INSERT ON users
+            BEGIN UPDATE counters SET value = value + 1 WHERE name = 'users'; END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS users_version_update AFTER UPDATE ON users
+            BEGIN UPDATE counters SET value = value + 1 WHERE name = 'users'; END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS users_version_delete AFTER DELETE ON users
+            BEGIN UPDATE counters SET value = value + 1 WHERE name = 'users'; END
+            """,
+        ],
+    ),
+    (
+        3,
+        "Index for a user's tasks in due date order (query_tasks)",
+        [
+            "CREATE INDEX IF NOT EXISTS tasks_by_assignee_due ON tasks (assigned_to, due_date)",
+        ],
+    ),
+    (
+        4,
+        "Task revisions for the changes feed, deleted tasks kept as tombstones",
+        [
+            "ALTER TABLE tasks ADD COLUMN revision INTEGER NOT NULL DEFAULT 0",
+            "UPDATE tasks SET revision = id",
+            "INSERT OR IGNORE INTO counters (name, value) VALUES ('tasks', (SELECT COALESCE(MAX(id), 0) FROM tasks))",
+            "CREATE INDEX IF NOT EXISTS tasks_by_revision ON tasks (revision)",
+            """
+            CREATE TABLE IF NOT EXISTS task_tombstones (
+                task_id INTEGER NOT NULL,
+                revision INTEGER PRIMARY KEY
+            )
+            """,
+            # Writers are serialized, so revisions are handed out in commit order
+            """
+            CREATE TRIGGER IF NOT EXISTS tasks_revision_insert AFTER INSERT ON tasks
+            BEGIN
+                UPDATE counters SET value = value + 1 WHERE name = 'tasks';
+                UPDATE tasks SET revision = (SELECT value FROM counters WHERE name = 'tasks') WHERE id = NEW.id;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS tasks_revision_update AFTER UPDATE ON tasks
+            WHEN NEW.revision = OLD.revision
+            BEGIN
+                UPDATE counters SET value = value + 1 WHERE name = 'tasks';
+                UPDATE tasks SET revision = (SELECT value FROM counters WHERE name = 'tasks') WHERE id = NEW.id;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS tasks_revision_delete AFTER DELETE ON tasks
+            BEGIN
+                UPDATE counters SET value = value + 1 WHERE name = 'tasks';
+                INSERT INTO task_tombstones (task_id, revision)
+                VALUES (OLD.id, (SELECT value FROM counters WHERE name = 'tasks'));
+            END
+            """,
+        ],
+    ),
+    (
+        5,
+        "The committer's UTC offset in the commit index, indexes are rebuilt to fill it",
+        [
+            "ALTER TABLE commits ADD COLUMN commit_tz TEXT NOT NULL DEFAULT '+0000'",
+            # Without a recorded head the next update re-indexes the group
+            "DELETE FROM commit_heads",
+        ],
+    ),
+    (
+        6,
+        "One commit_files row per (group, commit, path), re-ingesting a commit is a no-op",
+        [
+            """
+            DELETE FROM commit_files WHERE rowid NOT IN (
+                SELECT MIN(rowid) FROM commit_files GROUP BY group_number, hash, path
+            )
+            """,
+            "CREATE UNIQUE INDEX IF NOT EXISTS commit_files_unique ON commit_files (group_number, hash, path)",
+        ],
+    ),
+    (
+        7,
+        "Tasks stored before task_hash carry a per-process hash(), recompute it",
+        [
+            # Rows that turn out to be duplicates keep the oldest
+            """
+            DELETE FROM tasks WHERE id NOT IN (
+                SELECT MIN(id) FROM tasks
+                GROUP BY task_hash(title, description, assigned_to, status, priority)
+            )
+            """,
+            "UPDATE tasks SET hash = task_hash(title, description, assigned_to, status, priority)",
+        ],
+    ),
+]
+
+
+def migrate(conn: sqlite3.Connection, upto: int = None) -> int:
+    """
+    Applies the pending MIGRATIONS (up to version `upto`) and returns the
+    schema version. BEGIN IMMEDIATE makes concurrent workers wait for each
+    other, so every migration runs once.
+    """
     conn.commit()
-    print(f"User '{user.name}' signed in and added to database.")
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, _, statements in MIGRATIONS:
+            if number <= version or (upto is not None and number > upto):
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            version = number
+        conn.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return version
+
+
+with connection() as conn:
+    create_schema(conn)
+    migrate(conn)
+
+
+# 4. sign_in remains unchanged
+def sign_in(user: User):
+    with connection() as conn:
+        cursor = conn.cursor()
+
+        # Check if a user with the same email already exists
+        cursor.execute("SELECT 1 FROM users WHERE email = ?", (user.email,))
+        if cursor.fetchone():
+            log.info("User with email %r already exists.", user.email)
+            return
+
+        # Check if that role is already taken
+        cursor.execute("SELECT 1 FROM users WHERE role = ?", (user.role,))
+        if cursor.fetchone():
+            log.info("The role %r is already taken.", user.role)
+            return
+
+        # Insert the new user (github_url will default to NULL)
+        cursor.execute(
+            """
+            INSERT INTO users (
+                name,
+                "Academic group",
+                "PBL group number",
+                email,
+                role,
+                password,
+                "Project name",
+                github_url
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+            (
+                user.name,
+                user.academic_group,
+                user.pbl_group_number,
+                user.email,
+                user.role,
+                user.password,
+                user.project_name,
+                user.github_url,
+            ),
+        )
+        log.info("User %r signed in and added to database.", user.name)
+    invalidate_roster()
 
 
 def log_in(email: str, password: str):
     """
     Checks if the user with the given email and password exists in the database.
     """
-    cursor.execute(
-        "SELECT 1 FROM users WHERE email = ? AND password = ?", (email, password)
-    )
-    user = cursor.fetchone()
-    return user
+    with connection() as conn:
+        return conn.execute(
+            "SELECT 1 FROM users WHERE email = ? AND password = ?", (email, password)
+        ).fetchone()
 
 
 # 5. New helper: fetch all GitHub URLs for a given PBL group number
@@ -152,54 +466,528 @@ def get_github_urls_by_pbl_group(pbl_group_number):
     """
     Returns a list of all non-null GitHub URLs for users in the specified PBL group.
     """
-    cursor.execute(
-        'SELECT github_url FROM users WHERE "PBL group number" = ? AND github_url IS NOT NULL',
-        (pbl_group_number,),
-    )
-    return [row[0] for row in cursor.fetchall()]
+    with connection() as conn:
+        rows = conn.execute(
+            'SELECT github_url FROM users WHERE "PBL group number" = ? AND github_url IS NOT NULL',
+            (pbl_group_number,),
+        ).fetchall()
+    return [row[0] for row in rows]
+
+
+# Roster cache: (name, role, project name) per PBL group, read on every
+# AI request. The users triggers bump counters.users on any write, a
+# process rechecks that version at most every ROSTER_CHECK_INTERVAL
+# seconds, so other workers see a sign_in within that interval and this
+# one at once.
+ROSTER_CHECK_INTERVAL = float(os.environ.get("ROSTER_CHECK_INTERVAL", 1))
+
+_roster = {}  # group (None for everyone) -> tuple of (name, role, project name)
+_roster_version = None
+_roster_checked = 0.0
+_roster_lock = threading.Lock()
+
+
+def users_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT value FROM counters WHERE name = 'users'").fetchone()
+    return row[0] if row else 0
+
+
+def invalidate_roster():
+    global _roster_version
+    with _roster_lock:
+        _roster.clear()
+        _roster_version = None
+
+
+def get_roster(pbl_group_number=None) -> tuple:
+    """
+    Returns ((name, role, project name), ...) for the users of the PBL group,
+    or of everyone when no group is given, in insertion order.
+    """
+    global _roster_version, _roster_checked
+    key = None if pbl_group_number is None else str(pbl_group_number)
+    now = time.monotonic()
+    with _roster_lock:
+        if _roster_version is not None and now - _roster_checked < ROSTER_CHECK_INTERVAL and key in _roster:
+            return _roster[key]
+
+    with connection() as conn:
+        version = users_version(conn)
+        with _roster_lock:
+            if version != _roster_version:
+                _roster.clear()
+                _roster_version = version
+            _roster_checked = now
+            if key in _roster:
+                return _roster[key]
+        if key is None:
+            rows = conn.execute('SELECT name, role, "Project name" FROM users ORDER BY id').fetchall()
+        else:
+            rows = conn.execute(
+                'SELECT name, role, "Project name" FROM users WHERE "PBL group number" = ? ORDER BY id',
+                (key,),
+            ).fetchall()
+    roster = tuple(rows)
+    with _roster_lock:
+        if _roster_version == version:
+            _roster[key] = roster
+    return roster
+
+
+def task_hash(task: Task) -> str:
+    """
+    Stable digest of the fields that make a task a duplicate, the same in
+    every process (the built-in hash() is randomized per process).
+    """
+    return _hash_task_fields(*(getattr(task, f) for f in TASK_HASH_FIELDS))
 
 
 def new_task(task: Task):
     """
     Adds a new task to the tasks table.
     """
-    cursor.execute(
-        """
-        INSERT INTO tasks (
-            title,
-            description,
-            assigned_to,
-            status,
-            priority,
-            due_date,
-            hash
-        ) VALUES (?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            task.title,
-            task.description,
-            task.assigned_to,
-            task.status,
-            task.priority,
-            task.due_date,
-            hash(
-                task.title
-                + task.description
-                + task.assigned_to
-                + task.status
-                + task.priority
+    with connection() as conn:
+        conn.execute(
+            """
+            INSERT INTO tasks (
+                title,
+                description,
+                assigned_to,
+                status,
+                priority,
+                due_date,
+                hash
+            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                task.title,
+                task.description,
+                task.assigned_to,
+                task.status,
+                task.priority,
+                task.due_date,
+                task_hash(task),
             ),
-        ),
+        )
+    _notify_tasks()
+
+
+def new_tasks(tasks) -> dict:
+    """
+    Adds a whole list of tasks in one transaction. Tasks already stored
+    (same task_hash) are skipped.
+    Returns {"inserted": n, "deduplicated": n}.
+    """
+    rows = [
+        (t.title, t.description, t.assigned_to, t.status, t.priority, t.due_date, task_hash(t))
+        for t in tasks
+    ]
+    with connection() as conn:
+        # rowcount counts the rows inserted, not the ignored ones or the trigger writes
+        inserted = conn.executemany(
+            """
+            INSERT OR IGNORE INTO tasks (
+                title, description, assigned_to, status, priority, due_date, hash
+            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        ).rowcount
+    if inserted:
+        _notify_tasks()
+    return {"inserted": inserted, "deduplicated": len(rows) - inserted}
+
+
+def task_from_ai(ai_task: dict, start: date = None, status: str = "todo") -> Task:
+    """
+    Task row for an AiTask from bublikproblem.distribute_tasks, due
+    estimatedDays after `start` (today by default).
+    """
+    due = (start or date.today()) + timedelta(days=int(ai_task.get("estimatedDays") or 0))
+    return Task(
+        None,
+        ai_task["title"],
+        ai_task["description"],
+        ai_task["assignedRole"],
+        status,
+        ai_task["priority"],
+        due.isoformat(),
     )
-    conn.commit()
 
 
-def get_tasks():
+TASK_COLUMNS = ("id", "title", "description", "assigned_to", "status", "priority", "due_date")
+TASK_FIELDS = TASK_COLUMNS + ("revision",)
+# Fields a task update may change
+TASK_UPDATABLE = ("title", "description", "assigned_to", "status", "priority", "due_date")
+TASK_PRIORITIES = ("low", "medium", "high")
+# order -> columns of the keyset, in ORDER BY order
+TASK_ORDERS = {"id": ("id",), "due_date": ("due_date", "id")}
+
+
+def get_tasks(assigned_to=None):
+    """
+    Returns a list of tasks, only those assigned to `assigned_to` if given.
+    """
+    rows, _ = query_tasks(assigned_to=assigned_to, limit=None, fields=TASK_COLUMNS)
+    return [Task(**row) for row in rows]
+
+
+def _checked_task_fields(fields: dict) -> dict:
+    """
+    The update values with due_date normalized, ValueError if one is not
+    valid for its column.
+    """
+    checked = {}
+    for name, value in fields.items():
+        if not isinstance(value, str) or (name != "description" and not value.strip()):
+            raise ValueError(f"{name} must be a non-empty string")
+        if name == "priority" and value not in TASK_PRIORITIES:
+            raise ValueError(f"priority must be one of {', '.join(TASK_PRIORITIES)}")
+        if name == "due_date":
+            try:
+                value = date.fromisoformat(value).isoformat()
+            except ValueError:
+                raise ValueError("due_date must be an ISO date (YYYY-MM-DD)") from None
+        checked[name] = value
+    return checked
+
+
+def update_task(task_id: int, **fields) -> bool:
+    """
+    Changes the given TASK_UPDATABLE fields of a task, False if there is no such task.
+    Raises ValueError for an invalid value or a change that makes it a
+    duplicate of another task.
+    """
+    unknown = set(fields) - set(TASK_UPDATABLE)
+    if unknown or not fields:
+        raise ValueError(f"can only update {', '.join(TASK_UPDATABLE)}")
+    fields = _checked_task_fields(fields)
+    # SET expressions see the old row, so the hash takes the new values as parameters
+    hash_args = ", ".join("?" if f in fields else f for f in TASK_HASH_FIELDS)
+    try:
+        with connection() as conn:
+            cursor = conn.execute(
+                f"""
+                UPDATE tasks SET {', '.join(f'{k} = ?' for k in fields)}, hash = task_hash({hash_args})
+                WHERE id = ?
+                """,
+                (*fields.values(), *(fields[f] for f in TASK_HASH_FIELDS if f in fields), task_id),
+            )
+            updated = cursor.rowcount > 0
+    except sqlite3.IntegrityError as e:
+        if "tasks.hash" not in str(e):
+            raise
+        raise ValueError("an identical task already exists") from None
+    if updated:
+        _notify_tasks()
+    return updated
+
+
+def delete_task(task_id: int) -> bool:
+    with connection() as conn:
+        deleted = conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,)).rowcount > 0
+    if deleted:
+        _notify_tasks()
+    return deleted
+
+
+# Changes feed: every insert, update and delete gets the next revision
+# (triggers of migration 4). Waiters in this process are woken by local
+# writes, writes of other workers are noticed by polling the counter.
+TASK_POLL_INTERVAL = float(os.environ.get("TASK_POLL_INTERVAL", 0.5))
+_tasks_changed = threading.Condition()
+
+
+def _notify_tasks():
+    with _tasks_changed:
+        _tasks_changed.notify_all()
+
+
+def tasks_revision() -> int:
+    with connection() as conn:
+        row = conn.execute("SELECT value FROM counters WHERE name = 'tasks'").fetchone()
+    return row[0] if row else 0
+
+
+def wait_for_tasks(since: int, timeout: float) -> int:
+    """
+    Waits up to `timeout` seconds for a task revision newer than `since`
+    and returns the current revision.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        revision = tasks_revision()
+        remaining = deadline - time.monotonic()
+        if revision > since or remaining <= 0:
+            return revision
+        with _tasks_changed:
+            _tasks_changed.wait(min(TASK_POLL_INTERVAL, remaining))
+
+
+def task_changes(since: int, limit: int = 500, fields=None) -> dict:
+    """
+    Tasks inserted or updated after revision `since`, oldest change first,
+    and the ids of tasks deleted since then.
+    Returns {"changes": [...], "deleted": [...], "revision": r, "more": bool}:
+    pass `revision` as `since` next time, `more` means call again right away.
+    """
+    fields = list(fields or TASK_FIELDS)
+    unknown = set(fields) - set(TASK_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+    columns = fields + [c for c in ("revision",) if c not in fields]
+    with connection() as conn:
+        # One read transaction so the rows, tombstones and revision agree
+        conn.execute("BEGIN")
+        current = conn.execute("SELECT value FROM counters WHERE name = 'tasks'").fetchone()[0]
+        rows = [
+            dict(zip(columns, row))
+            for row in conn.execute(
+                f"SELECT {', '.join(columns)} FROM tasks WHERE revision > ? ORDER BY revision LIMIT ?",
+                (since, limit),
+            )
+        ]
+        more = len(rows) == limit
+        upto = rows[-1]["revision"] if more else current
+        deleted = [
+            row[0]
+            for row in conn.execute(
+                "SELECT task_id FROM task_tombstones WHERE revision > ? AND revision <= ? ORDER BY revision",
+                (since, upto),
+            )
+        ]
+    return {
+        "changes": [{f: row[f] for f in fields} for row in rows],
+        "deleted": deleted,
+        "revision": upto,
+        "more": more,
+    }
+
+
+def _task_filter(assigned_to=None, status=None, priority=None, due_from=None, due_to=None):
+    """
+    Builds the WHERE clause of the task queries. status and priority take
+    one value or a list, due_from/due_to are inclusive ISO dates.
+    """
+    where, params = [], []
+    if assigned_to:
+        where.append("assigned_to = ?")
+        params.append(assigned_to)
+    for column, value in (("status", status), ("priority", priority)):
+        if value:
+            values = [value] if isinstance(value, str) else list(value)
+            where.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params += values
+    if due_from:
+        where.append("due_date >= ?")
+        params.append(due_from)
+    if due_to:
+        where.append("due_date <= ?")
+        params.append(due_to)
+    return " AND ".join(where) or "1", params
+
+
+def query_tasks(limit=50, cursor=None, fields=None, order="id", **filters):
+    """
+    One page of tasks as dicts with the requested `fields` (all by default),
+    filtered by assigned_to, status, priority, due_from and due_to.
+    Ordered by `order` ("id" or "due_date") with keyset pagination:
+    `cursor` is the next_cursor of the previous page.
+    Returns (rows, next_cursor), next_cursor is None on the last page.
+    """
+    if order not in TASK_ORDERS:
+        raise ValueError(f"order must be one of {', '.join(TASK_ORDERS)}")
+    fields = list(fields or TASK_FIELDS)
+    unknown = set(fields) - set(TASK_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+    keys = TASK_ORDERS[order]
+
+    where, params = _task_filter(**filters)
+    if cursor is not None:
+        values = str(cursor).split("|")
+        if len(values) != len(keys):
+            raise ValueError("malformed cursor")
+        if keys[-1] == "id":
+            values[-1] = int(values[-1])
+        where += f" AND ({', '.join(keys)}) > ({', '.join('?' * len(keys))})"
+        params += values
+
+    columns = fields + [k for k in keys if k not in fields]
+    sql = f"SELECT {', '.join(columns)} FROM tasks WHERE {where} ORDER BY {', '.join(keys)}"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+
+    with connection() as conn:
+        rows = [dict(zip(columns, row)) for row in conn.execute(sql, params)]
+    next_cursor = None
+    if limit is not None and len(rows) == limit:
+        next_cursor = "|".join(str(rows[-1][k]) for k in keys)
+    return [{f: row[f] for f in fields} for row in rows], next_cursor
+
+
+# --- Commit index ---
+
+
+def get_indexed_head(group_number) -> str | None:
     """
-    Returns a list of tasks assigned to the user with the given id.
+    Returns the last ingested HEAD for the group, None if it was never indexed.
     """
-    cursor.execute("SELECT * FROM tasks")
-    return [Task(*row) for row in cursor.fetchall()]
+    with connection() as c:
+        row = c.execute(
+            "SELECT head FROM commit_heads WHERE group_number = ?", (str(group_number),)
+        ).fetchone()
+        return row[0] if row else None
+
+
+def index_commits(group_number, commits: list[Commit], head: str, replace: bool = False):
+    """
+    Stores `commits` (newest first, as git log gives them) on top of the
+    already indexed ones and records `head`, all in one transaction.
+    replace=True drops the old index first (e.g. after a force push).
+    """
+    group = str(group_number)
+    with connection() as c:
+        if replace:
+            c.execute("DELETE FROM commit_files WHERE group_number = ?", (group,))
+            c.execute("DELETE FROM commits WHERE group_number = ?", (group,))
+
+        top = c.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM commits WHERE group_number = ?", (group,)
+        ).fetchone()[0]
+        c.executemany(
+            """
+            INSERT OR IGNORE INTO commits (
+                group_number, hash, seq, parents, author, email, author_time,
+                committer, committer_email, commit_time, commit_tz, message, insertions, deletions
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                (
+                    group, cm.hash, top + len(commits) - i, " ".join(cm.parents),
+                    cm.author, cm.email, cm.author_time, cm.committer,
+                    cm.committer_email, cm.commit_time, cm.commit_tz, cm.message,
+                    cm.insertions, cm.deletions,
+                )
+                for i, cm in enumerate(commits)
+            ),
+        )
+        c.executemany(
+            """
+            INSERT OR IGNORE INTO commit_files (
+                group_number, hash, path, old_path, insertions, deletions
+            ) VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (
+                (group, cm.hash, f.path, f.old_path, f.insertions, f.deletions)
+                for cm in commits
+                for f in cm.files
+            ),
+        )
+        c.execute(
+            """
+            INSERT INTO commit_heads (group_number, head) VALUES (?, ?)
+            ON CONFLICT (group_number) DO UPDATE
+            SET head = excluded.head, updated_at = CURRENT_TIMESTAMP
+            """,
+            (group, head),
+        )
+
+
+# identity -> (name, email, time) columns the filters match
+COMMIT_IDENTITIES = {
+    "author": ("c.author", "c.email", "c.author_time"),
+    "committer": ("c.committer", "c.committer_email", "c.commit_time"),
+}
+
+
+def _commit_filter(
+    group_number, author=None, email=None, since=None, until=None, path_prefix=None, identity="author"
+):
+    """
+    Builds the WHERE clause shared by the commit index queries.
+    author matches the name or the email, since/until are epoch seconds,
+    all three on the author or the committer depending on `identity`.
+    """
+    name_col, email_col, time_col = COMMIT_IDENTITIES[identity]
+    where = ["c.group_number = ?"]
+    params = [str(group_number)]
+    if author:
+        where.append(f"({name_col} = ? COLLATE NOCASE OR {email_col} = ? COLLATE NOCASE)")
+        params += [author, author]
+    if email:
+        where.append(f"{email_col} = ? COLLATE NOCASE")
+        params.append(email)
+    if since is not None:
+        where.append(f"{time_col} >= ?")
+        params.append(int(since))
+    if until is not None:
+        where.append(f"{time_col} < ?")
+        params.append(int(until))
+    if path_prefix:
+        # A case-sensitive range over commit_files_by_path (LIKE would ignore
+        # case and skip the index): path >= prefix AND path < the next prefix
+        where.append(
+            """c.hash IN (
+                SELECT f.hash FROM commit_files f
+                WHERE f.group_number = ? AND f.path >= ? AND f.path < ?
+            )"""
+        )
+        params += [str(group_number), path_prefix, path_prefix[:-1] + chr(ord(path_prefix[-1]) + 1)]
+    return " AND ".join(where), params
+
+
+def count_indexed_commits(group_number, **filters) -> int:
+    where, params = _commit_filter(group_number, **filters)
+    with connection() as c:
+        return c.execute(f"SELECT COUNT(*) FROM commits c WHERE {where}", params).fetchone()[0]
+
+
+def iter_indexed_commits(group_number, limit=None, cursor=None, **filters):
+    """
+    Yields (seq, Commit) for the indexed commits of a group, newest first.
+    `cursor` is the seq of the last commit of the previous page.
+    """
+    group = str(group_number)
+    where, params = _commit_filter(group_number, **filters)
+    if cursor is not None:
+        where += " AND c.seq < ?"
+        params.append(int(cursor))
+    sql = f"""
+        SELECT c.seq, c.hash, c.parents, c.author, c.email, c.author_time,
+               c.committer, c.committer_email, c.commit_time, c.message, c.commit_tz
+        FROM commits c WHERE {where} ORDER BY c.seq DESC
+    """
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+
+    with connection() as c:
+        for row in c.execute(sql, params):
+            files = [
+                FileStat(path, ins, dels, old_path)
+                for path, old_path, ins, dels in c.execute(
+                    """
+                    SELECT path, old_path, insertions, deletions
+                    FROM commit_files WHERE group_number = ? AND hash = ?
+                    ORDER BY rowid
+                    """,
+                    (group, row[1]),
+                )
+            ]
+            yield row[0], Commit(
+                hash=row[1],
+                parents=row[2].split(),
+                author=row[3],
+                email=row[4],
+                author_time=row[5],
+                committer=row[6],
+                committer_email=row[7],
+                commit_time=row[8],
+                message=row[9],
+                files=files,
+                commit_tz=row[10],
+            )
 
 
 # 6. Example usage: fetch GitHub links for your existing PBL group
@@ -208,27 +996,41 @@ if __name__ == "main":
     pbl_group_number = input("Enter the PBL group number: ")
     links = get_github_urls_by_pbl_group(pbl_group_number)
     print(f"GitHub URLs for PBL group {pbl_group_number}: {links}")
-
-    conn.close()
 1
 
 
-def init_convo_db():
-
-    conn = sqlite3.connect("bublik_convo.db")
-    c = conn.cursor()
+def init_convo_db(path: str = "bublik_convo.db"):
 
-    c.execute(
+    with connection(path) as conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS convo (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                ts DATETIME DEFAULT CURRENT_TIMESTAMP,
+                session_id TEXT NOT NULL DEFAULT 'default',
+                tokens INTEGER
+            )
         """
-        CREATE TABLE IF NOT EXISTS convo (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            role TEXT NOT NULL,
-            content TEXT NOT NULL,
-            ts DATETIME DEFAULT CURRENT_TIMESTAMP
         )
-    """
-    )
-
-    conn.commit()
+        # Databases created before sessions existed
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(convo)")]
+        if "session_id" not in columns:
+            conn.execute("ALTER TABLE convo ADD COLUMN session_id TEXT NOT NULL DEFAULT 'default'")
+        if "tokens" not in columns:
+            conn.execute("ALTER TABLE convo ADD COLUMN tokens INTEGER")
+        conn.execute("CREATE INDEX IF NOT EXISTS convo_by_session ON convo (session_id, id)")
 
-    conn.close()
+        # Rolling summary of the turns up to (and including) upto_id
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS convo_summaries (
+                session_id TEXT PRIMARY KEY,
+                upto_id INTEGER NOT NULL,
+                summary TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """
+        )
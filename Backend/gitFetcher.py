@@ -1,25 +1,364 @@
 import os
+import time
+import logging
+import hashlib
+import threading
 import subprocess
 import gitParser
+import bublikmetrics
+import database
 import shutil
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ThreadPoolExecutor
+log = logging.getLogger(__name__)
+
 FILE_DIR = os.path.dirname(os.path.abspath(__file__))
 PATH = os.path.join(FILE_DIR, "git_data")
-TEST_GROUP_URL = "https://github.com/The1Dani/cubes.git"
+TEST_GROUP_URL = os.environ.get("GIT_GROUP_URL", "https://github.com/The1Dani/cubes.git")
+
+# Mirror cache settings
+# A mirror fetched less than MIRROR_TTL seconds ago is used as is.
+# When the cache grows over MIRROR_BUDGET bytes the least recently used
+# mirrors not being read are deleted. Each mirror's size is measured after
+# a clone or fetch and kept in SIZE_FILE, so eviction does not walk the
+# whole cache.
+MIRROR_TTL = float(os.environ.get("GIT_MIRROR_TTL", 60))
+MIRROR_BUDGET = int(os.environ.get("GIT_MIRROR_BUDGET_MB", 512)) * 1024 * 1024
+LAST_USED_FILE = "bublik_last_used"
+LAST_FETCH_FILE = "bublik_last_fetch"
+SIZE_FILE = "bublik_size"
+
+# Bounded pool for ingesting many groups at once
+GIT_WORKERS = int(os.environ.get("GIT_WORKERS", 8))
+_pool = ThreadPoolExecutor(max_workers=GIT_WORKERS, thread_name_prefix="git")
+
+_locks: dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+# mirror key -> reads in progress, a mirror being read is never evicted
+_readers: dict[str, int] = {}
+
 
 def get_group_url(group_number: int) -> str:
     return TEST_GROUP_URL
 
-def get_git_data_from_path(group_number: int, path=PATH) -> list[dict[str, any]]:
-    cmd = ["git", "clone", get_group_url(group_number), "--bare", path]
+
+def mirror_key(group_number: int, url: str) -> str:
+    """
+    One mirror per (group, url), so a group changing its repository
+    does not reuse the old history.
+    """
+    digest = hashlib.sha1(url.encode()).hexdigest()[:12]
+    group = "".join(c for c in str(group_number) if c.isalnum() or c in "-_")
+    return f"{group}-{digest}.git"
+
+
+def _lock_for(key: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(key, threading.Lock())
+
+
+@contextmanager
+def using_mirror(group_number: int, root=PATH, ttl=MIRROR_TTL):
+    """
+    ensure_mirror for a read: the mirror is not evicted until the block exits.
+        with using_mirror(group_number) as mirror:
+            gitParser.get_git_data(mirror)
+    """
+    key = mirror_key(group_number, get_group_url(group_number))
+    # Counted before ensure_mirror, so eviction cannot slip in between
+    with _locks_guard:
+        _readers[key] = _readers.get(key, 0) + 1
+    try:
+        yield ensure_mirror(group_number, root=root, ttl=ttl)
+    finally:
+        with _locks_guard:
+            _readers[key] -= 1
+            if not _readers[key]:
+                del _readers[key]
+
+
+def _reading(key: str) -> bool:
+    with _locks_guard:
+        return key in _readers
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OverflowError):
+        pass
+    return True
+
+
+def _sweep_tmp(root: str, name: str):
+    """
+    Removes the leftover of a clone that died before its rename, i.e. one
+    whose process is gone or, in this process, whose lock is free.
+    """
+    key, _, owner = name.partition(".tmp-")
+    try:
+        pid = int(owner.split("-")[0])
+    except ValueError:
+        return
+    if pid != os.getpid():
+        if not _pid_alive(pid):
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+        return
+    lock = _lock_for(key)
+    if not lock.acquire(blocking=False):
+        return
+    try:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    finally:
+        lock.release()
+
+
+def _touch(path: str):
+    with open(path, "a"):
+        os.utime(path, None)
+
+
+def _mtime(path: str) -> float:
     try:
-        subprocess.run(cmd, check=True)
+        return os.path.getmtime(path)
+    except OSError:
+        return 0.0
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+
+def _record_size(mirror: str) -> int:
+    """
+    Measures the mirror and stores the result in its SIZE_FILE.
+    """
+    size = _dir_size(mirror)
+    with open(os.path.join(mirror, SIZE_FILE), "w") as f:
+        f.write(str(size))
+    return size
+
+
+def _mirror_size(mirror: str) -> int:
+    try:
+        with open(os.path.join(mirror, SIZE_FILE)) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        # Mirrors from before the size was recorded
+        return _record_size(mirror)
+
+
+def evict_mirrors(keep: str = "", root=PATH, budget=MIRROR_BUDGET):
+    """
+    Delete the least recently used mirrors until the cache fits in the budget.
+    The mirror named `keep` and mirrors being read are never deleted.
+    Leftovers of failed clones are removed along the way.
+    """
+    if not os.path.isdir(root):
+        return
+    mirrors = []
+    for name in os.listdir(root):
+        mirror = os.path.join(root, name)
+        if ".git.tmp-" in name:
+            _sweep_tmp(root, name)
+            continue
+        if not name.endswith(".git") or not os.path.isdir(mirror):
+            continue
+        mirrors.append((_mtime(os.path.join(mirror, LAST_USED_FILE)), name, _mirror_size(mirror)))
+
+    total = sum(size for _, _, size in mirrors)
+    for _, name, size in sorted(mirrors):
+        if total <= budget:
+            break
+        if name == keep or _reading(name):
+            continue
+        lock = _lock_for(name)
+        if not lock.acquire(blocking=False):
+            # Being cloned or fetched right now, so it is not cold
+            continue
+        try:
+            # A read that started meanwhile waits for this lock in ensure_mirror
+            # and clones again, one that is counted already keeps its mirror
+            if _reading(name):
+                continue
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+            total -= size
+        finally:
+            lock.release()
+
+
+def ensure_mirror(group_number: int, root=PATH, ttl=MIRROR_TTL) -> str:
+    """
+    Returns the path of an up to date bare mirror for the group.
+    The first call clones, later calls fetch only new objects and calls
+    within `ttl` seconds of the last fetch do not touch the network.
+    """
+    url = get_group_url(group_number)
+    key = mirror_key(group_number, url)
+    mirror = os.path.join(root, key)
+    os.makedirs(root, exist_ok=True)
+
+    changed = False
+    with _lock_for(key):
+        if not os.path.isdir(mirror):
+            tmp = f"{mirror}.tmp-{os.getpid()}-{threading.get_ident()}"
+            shutil.rmtree(tmp, ignore_errors=True)
+            cmd = ["git", "clone", "--mirror", "--quiet", url, tmp]
+            try:
+                with bublikmetrics.GIT_DURATION.time(command="clone"):
+                    subprocess.run(cmd, check=True)
+            except subprocess.CalledProcessError:
+                shutil.rmtree(tmp, ignore_errors=True)
+                raise
+            os.rename(tmp, mirror)
+            _touch(os.path.join(mirror, LAST_FETCH_FILE))
+            changed = True
+        elif time.time() - _mtime(os.path.join(mirror, LAST_FETCH_FILE)) >= ttl:
+            cmd = ["git", "--git-dir", mirror, "fetch", "--prune", "--quiet", "origin"]
+            try:
+                with bublikmetrics.GIT_DURATION.time(command="fetch"):
+                    subprocess.run(cmd, check=True)
+                _touch(os.path.join(mirror, LAST_FETCH_FILE))
+                changed = True
+            except subprocess.CalledProcessError as e:
+                # Serve the stale copy rather than nothing
+                log.warning("Error fetching repository, using cached mirror: %s", e)
+        if changed:
+            _record_size(mirror)
+        _touch(os.path.join(mirror, LAST_USED_FILE))
+
+    # Only a clone or fetch can grow the cache
+    if changed:
+        evict_mirrors(keep=key, root=root)
+    return mirror
+
+
+def get_git_data_from_path(group_number: int, path=PATH, mode="stat") -> list[dict[str, any]]:
+    with ExitStack() as stack:
+        try:
+            mirror = stack.enter_context(using_mirror(group_number, root=path))
+        except subprocess.CalledProcessError as e:
+            log.error("Error cloning repository of group %s: %s", group_number, e)
+            return []
+
+        # Every group has its own mirror and git is pointed at it with
+        # --git-dir, so concurrent requests never share a working directory
+        return gitParser.get_git_data(mirror, mode=mode)
+
+
+def get_git_data_for_groups(group_numbers: list, path=PATH, mode="stat") -> dict[str, list[dict[str, any]]]:
+    """
+    Ingests several groups in parallel on the shared pool.
+    Takes about as long as the slowest group.
+    """
+    futures = {
+        str(group): _pool.submit(get_indexed_git_data, group, path, mode)
+        for group in dict.fromkeys(group_numbers)
+    }
+    results = {}
+    for group, future in futures.items():
+        try:
+            results[group] = future.result()
+        except Exception as e:
+            log.error("Error reading git data for group %s: %s", group, e)
+            results[group] = []
+    return results
+
+
+def stream_git_data_from_path(group_number: int, path=PATH, mode="stat"):
+    """
+    Like get_git_data_from_path but yields the commits as git produces them.
+    """
+    with ExitStack() as stack:
+        try:
+            mirror = stack.enter_context(using_mirror(group_number, root=path))
+        except subprocess.CalledProcessError as e:
+            log.error("Error cloning repository of group %s: %s", group_number, e)
+            return
+
+        if mode == "numstat":
+            yield from (dict(c) for c in gitParser.stream_git_records(mirror))
+        else:
+            yield from gitParser.stream_git_data(mirror)
+
+
+def update_commit_index(group_number: int, path=PATH) -> str:
+    """
+    Brings the group's commit index up to HEAD, parsing only the commits
+    after the last indexed head. Returns the mirror path.
+    """
+    with using_mirror(group_number, root=path) as mirror:
+        git = ["git", "--git-dir", mirror]
+        with bublikmetrics.GIT_DURATION.time(command="rev-parse"):
+            head = subprocess.run(git + ["rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+
+        with _lock_for(f"index-{group_number}"):
+            last_head = database.get_indexed_head(group_number)
+            if last_head == head:
+                return mirror
+
+            # History was rewritten (or never indexed), start from scratch
+            rewritten = last_head is None or subprocess.run(
+                git + ["merge-base", "--is-ancestor", last_head, head], capture_output=True
+            ).returncode != 0
+            rev_range = head if rewritten else f"{last_head}..{head}"
+
+            # Raises CalledProcessError if git log fails partway, so a partial
+            # range is never stored and `head` is only recorded after a clean run
+            commits = list(gitParser.stream_git_records(mirror, rev_range))
+            database.index_commits(group_number, commits, head, replace=rewritten)
+        return mirror
+
+
+def _identity(mode: str) -> str:
+    # The filters match what the results show: the stat format shows the
+    # committer (as git log --pretty=fuller's Commit line), numstat the author
+    return "committer" if mode == "stat" else "author"
+
+
+def count_indexed_git_data(group_number: int, mode="stat", **filters) -> int:
+    return database.count_indexed_commits(group_number, identity=_identity(mode), **filters)
+
+
+def stream_indexed_git_data(group_number: int, path=PATH, mode="stat", limit=None, cursor=None, **filters):
+    """
+    Serves (seq, commit) pairs from the SQLite index after an incremental update.
+    Filters are the ones of database.iter_indexed_commits, matched on the
+    committer in the stat format and on the author in numstat.
+    """
+    try:
+        update_commit_index(group_number, path)
     except subprocess.CalledProcessError as e:
-        print(f"Error cloning repository: {e}")
-        return []
-    
-    os.chdir(path)
-    data = gitParser.get_git_data()
-    os.chdir(FILE_DIR)
-    shutil.rmtree(PATH)
-    
-    return data
\ No newline at end of file
+        log.error("Error updating commit index of group %s: %s", group_number, e)
+        # Fall through and serve whatever is indexed
+
+    filters["identity"] = _identity(mode)
+    for seq, commit in database.iter_indexed_commits(group_number, limit, cursor, **filters):
+        yield seq, dict(commit) if mode == "numstat" else gitParser.to_stat_dict(commit)
+
+
+def get_indexed_git_data(group_number: int, path=PATH, mode="stat") -> list[dict[str, any]]:
+    return [commit for _, commit in stream_indexed_git_data(group_number, path, mode)]
+
+
+def query_git_data(group_number: int, path=PATH, mode="stat", limit=None, cursor=None, **filters) -> dict[str, any]:
+    """
+    One page of commits plus the total matching the filters.
+    next_cursor is None once the last page was returned.
+    """
+    page = list(stream_indexed_git_data(group_number, path, mode, limit, cursor, **filters))
+    next_cursor = page[-1][0] if limit and len(page) == limit else None
+    return {
+        "results": [commit for _, commit in page],
+        "total": count_indexed_git_data(group_number, mode, **filters),
+        "next_cursor": next_cursor,
+    }
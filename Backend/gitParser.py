@@ -1,4 +1,8 @@
+import codecs
 import subprocess
+import time
+import bublikmetrics
+from typing import Iterable, Iterator
 # import os
 
 """
@@ -47,39 +51,308 @@ def get_commits(out: str) -> dict[str, list[str]]:
     return tps
 
 
+def parse_commit_lines(hash: str, lines: list[str]) -> dict[str, any]:
+    """
+    Parses the lines of a single commit (without the `commit` and `Merge` lines).
+    """
+    o = {}
+    author_line = list(filter(lambda x: x != "", lines[2].split(" ")))
+    date_line = list(filter(lambda x: x != "", lines[3].split(" ")))
+    o["hash"] = hash
+    o["message"] = lines[4].strip()
+    o["files"] = lines[5:]
+
+    o["author"] = " ".join(author_line[1:-1]).strip()
+    o["email"] = author_line[-1].strip().replace("<", "").replace(">", "")
+    o["date"] = " ".join(date_line[1:])
+    o["footer"] = lines[-1].strip()
+    return o
+
+
 def parse_commit(commits: dict[str, list[str]]) -> list[dict[str, any]]:
     """
     - Commit: <author> <\<email\>> #! [2]
     - CommitDate: <date> #! [3]
     """
-    out = []
-    for hash, lines in commits.items():
-        o = {}
-        author_line = list(filter(lambda x: x != "", lines[2].split(" ")))
-        date_line = list(filter(lambda x: x != "", lines[3].split(" ")))
-        o["hash"] = hash
-        o["message"] = lines[4].strip()
-        o["files"] = lines[5:]
+    return [parse_commit_lines(hash, lines) for hash, lines in commits.items()]
+
+
+def iter_commits(lines: Iterable[str]) -> Iterator[dict[str, any]]:
+    """
+    Same as parse_commit(get_commits(...)) but one commit at a time,
+    so only the lines of the current commit are kept in memory.
+    """
+    recent_hash = ""
+    current: list[str] = []
+
+    for s in lines:
+        s = s.rstrip("\n")
+        if s.startswith("commit"):
+            if recent_hash:
+                yield parse_commit_lines(recent_hash, current)
+            recent_hash = s.split(" ")[1]
+            current = []
+        elif s != "" and not s.startswith("Merge"):
+            current.append(s)
+
+    if recent_hash:
+        yield parse_commit_lines(recent_hash, current)
+
 
-        o["author"] = " ".join(author_line[1:-1]).strip()
-        o["email"] = author_line[-1].strip().replace("<", "").replace(">", "")
-        o["date"] = " ".join(date_line[1:])
-        o["footer"] = lines[-1].strip()
-        out.append(o)
-    return out
+def _observe_log(command: str, start: float, size: int, proc, finished: bool):
+    # Duration covers the consumer too, git log output is parsed as it arrives
+    outcome = ("ok" if proc.returncode == 0 else "error") if finished else "cancelled"
+    bublikmetrics.GIT_DURATION.observe(time.perf_counter() - start, command=command, outcome=outcome)
+    bublikmetrics.GIT_OUTPUT.observe(size, command=command)
 
 
-def get_git_data() -> list[dict[str, any]]:
+def stream_git_data(git_dir: str = None) -> Iterator[dict[str, any]]:
     """
-    Returns a dictionary with the git data.
+    Yields the parsed commits while `git log` is still running.
     """
-    # git log --stat --pretty=fuller
     cmd = ["git", "log", "--stat", "--pretty=fuller"]
+    if git_dir:
+        cmd = ["git", "--git-dir", git_dir, "log", "--stat", "--pretty=fuller"]
+
+    start = time.perf_counter()
+    size = 0
+    finished = False
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    try:
+        def lines():
+            nonlocal size
+            for line in proc.stdout:
+                size += len(line)
+                yield line.decode(errors="replace")
+        yield from iter_commits(lines())
+        finished = True
+    finally:
+        # The consumer may stop early, do not leave git blocked on the pipe
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        _observe_log("log-stat", start, size, proc, finished)
+    # A log that died partway must not pass for the whole history
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+# --- Machine readable mode ---
+# git log --numstat -z with a delimited --format. Every commit starts with
+# RECORD_SEP, header fields are separated by FIELD_SEP and the numstat
+# entries after the header are NUL terminated:
+#   <added>\t<deleted>\t<path>\0
+#   <added>\t<deleted>\t\0<old path>\0<new path>\0   (renames)
+# Binary files have "-" instead of the numbers.
+RECORD_SEP = "\x1e"
+FIELD_SEP = "\x1f"
+NUMSTAT_FORMAT = RECORD_SEP + FIELD_SEP.join(
+    ["%H", "%P", "%an", "%ae", "%at", "%cn", "%ce", "%ct", "%ci", "%B", ""]
+)
+
+
+class FileStat:
+    def __init__(self, path, insertions, deletions, old_path=None):
+        self.path = path
+        self.old_path = old_path
+        # None for binary files
+        self.insertions = insertions
+        self.deletions = deletions
+
+    def __iter__(self):
+        for key in self.__dict__:
+            yield key, getattr(self, key)
+
+
+class Commit:
+    def __init__(
+        self,
+        hash,
+        parents,
+        author,
+        email,
+        author_time,
+        committer,
+        committer_email,
+        commit_time,
+        message,
+        files,
+        commit_tz="+0000",
+    ):
+        self.hash = hash
+        self.parents = parents
+        self.author = author
+        self.email = email
+        self.author_time = author_time
+        self.committer = committer
+        self.committer_email = committer_email
+        self.commit_time = commit_time
+        # The committer's UTC offset, e.g. "+0200", for display
+        self.commit_tz = commit_tz
+        self.message = message
+        self.files = files
+
+    @property
+    def insertions(self) -> int:
+        return sum(f.insertions or 0 for f in self.files)
+
+    @property
+    def deletions(self) -> int:
+        return sum(f.deletions or 0 for f in self.files)
+
+    def __iter__(self):
+        for key in self.__dict__:
+            if key == "files":
+                yield key, [dict(f) for f in self.files]
+            else:
+                yield key, getattr(self, key)
+
 
-    # path = "/home/dani/faf/faf_bot_go"
-    # os.chdir(path)
+def _numstat_count(s: str):
+    return None if s == "-" else int(s)
 
-    res = subprocess.check_output(cmd)
 
-    out = get_commits(res)
-    return parse_commit(out)
+def parse_numstat_record(record: str) -> Commit:
+    """
+    Parses one RECORD_SEP separated chunk of NUMSTAT_FORMAT output.
+    """
+    (
+        hash, parents, author, email, author_time,
+        committer, committer_email, commit_time, commit_iso, message, rest,
+    ) = record.split(FIELD_SEP, 10)
+
+    files = []
+    tokens = iter(rest.lstrip("\0\n").split("\0"))
+    for token in tokens:
+        token = token.lstrip("\n")
+        if not token:
+            continue
+        added, deleted, path = token.split("\t", 2)
+        old_path = None
+        if not path:
+            old_path = next(tokens, "")
+            path = next(tokens, "")
+        files.append(FileStat(path, _numstat_count(added), _numstat_count(deleted), old_path))
+
+    return Commit(
+        hash=hash,
+        parents=parents.split(),
+        author=author,
+        email=email,
+        author_time=int(author_time),
+        committer=committer,
+        committer_email=committer_email,
+        commit_time=int(commit_time),
+        message=message.rstrip("\n"),
+        files=files,
+        commit_tz=commit_iso.rsplit(" ", 1)[-1],
+    )
+
+
+def iter_numstat_records(chunks: Iterable[str]) -> Iterator[Commit]:
+    """
+    Splits text chunks of NUMSTAT_FORMAT output into commits.
+    The chunks do not need to line up with the records.
+    """
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        records = pending.split(RECORD_SEP)
+        pending = records.pop()
+        for record in records:
+            if record:
+                yield parse_numstat_record(record)
+    if pending:
+        yield parse_numstat_record(pending)
+
+
+def stream_git_records(git_dir: str = None, rev_range: str = None, chunk_size: int = 65536) -> Iterator[Commit]:
+    """
+    Yields typed Commit records using git log --numstat -z.
+    Unlike stream_git_data this keeps the whole commit message and
+    gives integer insertions/deletions per file.
+    rev_range limits the log, e.g. "<old head>..HEAD".
+    """
+    cmd = ["git", "log", "-z", "--numstat", f"--format={NUMSTAT_FORMAT}"]
+    if rev_range:
+        cmd.append(rev_range)
+    if git_dir:
+        cmd[1:1] = ["--git-dir", git_dir]
+
+    start = time.perf_counter()
+    size = 0
+    finished = False
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    try:
+        def chunks():
+            nonlocal size
+            for chunk in iter(lambda: proc.stdout.read1(chunk_size), b""):
+                size += len(chunk)
+                yield decoder.decode(chunk)
+        yield from iter_numstat_records(chunks())
+        finished = True
+    finally:
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        _observe_log("log-numstat", start, size, proc, finished)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+def _plural(n: int, word: str) -> str:
+    return f"{n} {word}{'' if n == 1 else 's'}"
+
+
+def to_stat_dict(commit: Commit, bar_width: int = 50) -> dict[str, any]:
+    """
+    Renders a Commit in the shape parse_commit_lines returns: the committer
+    and the commit date in the committer's offset, as git log --pretty=fuller
+    shows them. The +/- bars are scaled to `bar_width`.
+    """
+    tz = commit.commit_tz
+    offset = (1 if tz[0] != "-" else -1) * (int(tz[1:3]) * 3600 + int(tz[3:5]) * 60)
+    t = time.gmtime(commit.commit_time + offset)
+    widest = max([(f.insertions or 0) + (f.deletions or 0) for f in commit.files] or [0])
+    scale = min(1.0, bar_width / widest) if widest else 1.0
+
+    files = []
+    for f in commit.files:
+        path = f"{f.old_path} => {f.path}" if f.old_path else f.path
+        if f.insertions is None:
+            files.append(f" {path} | Bin")
+            continue
+        bar = "+" * round(f.insertions * scale) + "-" * round(f.deletions * scale)
+        files.append(f" {path} | {f.insertions + f.deletions} {bar}".rstrip())
+
+    footer = f"{_plural(len(commit.files), 'file')} changed"
+    if commit.insertions or not commit.deletions:
+        footer += f", {_plural(commit.insertions, 'insertion')}(+)"
+    if commit.deletions or not commit.insertions:
+        footer += f", {_plural(commit.deletions, 'deletion')}(-)"
+    files.append(" " + footer)
+
+    return {
+        "hash": commit.hash,
+        "message": commit.message.split("\n", 1)[0].strip(),
+        "files": files,
+        "author": commit.committer,
+        "email": commit.committer_email,
+        "date": time.strftime(f"%a %b {t.tm_mday} %H:%M:%S %Y {tz}", t),
+        "footer": footer,
+    }
+
+
+def get_git_data(git_dir: str = None, mode: str = "stat") -> list[dict[str, any]]:
+    """
+    Returns a dictionary with the git data.
+    mode="stat" parses git log --stat --pretty=fuller (display strings),
+    mode="numstat" returns dict(Commit) records.
+    """
+    if mode == "numstat":
+        return [dict(c) for c in stream_git_records(git_dir)]
+    # git log --stat --pretty=fuller
+    return list(stream_git_data(git_dir))
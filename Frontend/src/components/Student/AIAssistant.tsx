@@ -1,4 +1,5 @@
 import React, { useState, useRef, useEffect } from 'react';
+import { readEventStream } from '../../utils/readEventStream';
 
 // --- ICONS ---
 // Defined once
@@ -28,6 +29,8 @@ const AIAssistant = () => {
         { id: 1, text: "Hello! How can I help you today?", sender: 'ai' }
     ]);
     const chatEndRef = useRef<HTMLDivElement>(null);
+    // Conversation id the server handed out, sent back so this chat keeps its own memory
+    const sessionIdRef = useRef<string | null>(null);
     const [isLoading, setIsLoading] = useState(false);
 
     useEffect(() => {
@@ -49,8 +52,8 @@ const AIAssistant = () => {
             setIsLoading(true);
             const response = await fetch('http://localhost:5500/chatbot', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ message: text })
+                headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
+                body: JSON.stringify({ message: text, session_id: sessionIdRef.current ?? undefined, stream: true })
             });
 
             if (!response.ok) {
@@ -59,11 +62,31 @@ const AIAssistant = () => {
                 throw new Error(`Server error (${response.status}): ${errorData.message || 'Unknown error'}`);
             }
 
-            const data = await response.json();
-            // *** FIX HERE: Change data.reply to data.answer ***
-            const aiReplyText = data.answer || 'Ne pare rău, nu am un răspuns acum.';
-            const aiMessage: Message = { id: Date.now() + 1, text: aiReplyText, sender: 'ai' };
-            setMessages(prev => [...prev, aiMessage]);
+            // A server without streaming (app_res.py) answers with plain JSON
+            if (response.headers.get('Content-Type')?.includes('application/json')) {
+                const data = await response.json();
+                if (data.session_id) sessionIdRef.current = data.session_id;
+                setMessages(prev => [...prev, { id: Date.now() + 1, text: data.answer || 'Ne pare rău, nu am un răspuns acum.', sender: 'ai' }]);
+                return;
+            }
+
+            // Show the answer while it is being generated
+            const aiId = Date.now() + 1;
+            setMessages(prev => [...prev, { id: aiId, text: '', sender: 'ai' }]);
+            const setAiText = (update: (text: string) => string) =>
+                setMessages(prev => prev.map(m => (m.id === aiId ? { ...m, text: update(m.text) } : m)));
+
+            await readEventStream(response, (event, data) => {
+                if (event === 'token') {
+                    setIsLoading(false);
+                    setAiText(t => t + data.delta);
+                } else if (event === 'done') {
+                    if (data.session_id) sessionIdRef.current = data.session_id;
+                    setAiText(() => data.answer || 'Ne pare rău, nu am un răspuns acum.');
+                } else if (event === 'error') {
+                    throw new Error(data.message);
+                }
+            });
         } catch (error) {
             console.error('Fetch error:', error);
             const errorMessage: Message = {
@@ -2,6 +2,7 @@
 import React, { useState, useEffect, useCallback } from 'react';
 import { Bot, Lightbulb, ArrowRight, RefreshCw, CheckCircle, Brain } from 'lucide-react';
 import { AiTask } from './types';    // instead of redeclaring
+import { readEventStream } from '../../utils/readEventStream';
 export interface AiTask {
   title: string;
   description: string;
@@ -51,17 +52,36 @@ export default function ProblemDefinition({ onComplete }: ProblemDefinitionProps
     try {
       const response = await fetch('http://localhost:5500/api/ideas', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ problem }),
+        headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
+        body: JSON.stringify({ problem, stream: true }),
       });
       if (!response.ok) throw new Error(`HTTP ${response.status}`);
-      const data = await response.json();
-      if (Array.isArray(data.ideas)) {
-        setIdeas(data.ideas);
-      } else {
-        setError('AI could not generate ideas. Please rephrase your problem.');
-        setIdeas([]);
+      const showIdeas = (all: unknown) => {
+        if (Array.isArray(all) && all.length) {
+          setIdeas(all);
+        } else {
+          setError('AI could not generate ideas. Please rephrase your problem.');
+          setIdeas([]);
+        }
+      };
+
+      // A server without streaming (app_res.py) answers with plain JSON
+      if (response.headers.get('Content-Type')?.includes('application/json')) {
+        const data = await response.json();
+        showIdeas(data.ideas);
+        return;
       }
+
+      // Ideas show up one by one as the AI writes them
+      await readEventStream(response, (event, data) => {
+        if (event === 'idea') {
+          setIdeas(prev => [...(prev ?? []), data.idea]);
+        } else if (event === 'done') {
+          showIdeas(data.ideas);
+        } else if (event === 'error') {
+          throw new Error(data.message);
+        }
+      });
     } catch (err: any) {
       console.error('Error fetching ideas:', err);
       setError(`Failed to fetch ideas: ${err.message}. Make sure your backend is running.`);
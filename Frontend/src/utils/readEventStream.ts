@@ -0,0 +1,31 @@
+// src/utils/readEventStream.ts
+// Reads a text/event-stream response body (EventSource only supports GET,
+// our streaming endpoints are POST) and calls onEvent for each event.
+export async function readEventStream(
+  response: Response,
+  onEvent: (event: string, data: any) => void
+): Promise<void> {
+  if (!response.body) throw new Error('Streaming is not supported by this browser');
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let sep: number;
+    while ((sep = buffer.indexOf('\n\n')) !== -1) {
+      const block = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+      let event = 'message';
+      const data: string[] = [];
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data.push(line.slice(5).trim());
+      }
+      if (data.length) onEvent(event, JSON.parse(data.join('\n')));
+    }
+  }
+}